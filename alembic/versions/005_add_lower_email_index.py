@@ -0,0 +1,25 @@
+"""add lower(email) index to users
+
+Revision ID: 005
+Revises: 004
+Create Date: 2024-01-15 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Lookups go through func.lower(User.email), so the plain unique index on
+    # email is never used for them.
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_email_lower', table_name='users')
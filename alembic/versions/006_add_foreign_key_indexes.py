@@ -0,0 +1,33 @@
+"""add foreign key and ordering indexes
+
+Revision ID: 006
+Revises: 005
+Create Date: 2024-01-22 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The composite indexes lead with the foreign key, so they also serve the
+    # ON DELETE CASCADE lookups added in 003.
+    op.create_index(op.f('ix_workspaces_owner_id'), 'workspaces', ['owner_id'], unique=False)
+    op.create_index(op.f('ix_boards_workspace_id'), 'boards', ['workspace_id'], unique=False)
+    op.create_index('ix_lists_board_id_position', 'lists', ['board_id', 'position'], unique=False)
+    op.create_index('ix_cards_list_id_position', 'cards', ['list_id', 'position'], unique=False)
+    op.create_index('ix_workspace_members_user_id', 'workspace_members', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_workspace_members_user_id', table_name='workspace_members')
+    op.drop_index('ix_cards_list_id_position', table_name='cards')
+    op.drop_index('ix_lists_board_id_position', table_name='lists')
+    op.drop_index(op.f('ix_boards_workspace_id'), table_name='boards')
+    op.drop_index(op.f('ix_workspaces_owner_id'), table_name='workspaces')
@@ -0,0 +1,54 @@
+"""add rank columns to lists and cards
+
+Revision ID: 007
+Revises: 006
+Create Date: 2024-02-05 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('lists', sa.Column('rank', sa.String(collation='C'), nullable=True))
+    op.add_column('cards', sa.Column('rank', sa.String(collation='C'), nullable=True))
+
+    # Backfill in the current position order. Zero-padded decimals are valid
+    # base-62 ranks, and the trailing 1 keeps room in front of each of them
+    # (see app.ranking).
+    op.execute("""
+        UPDATE lists SET rank = ranked.rank
+        FROM (
+            SELECT id, lpad((row_number() OVER (PARTITION BY board_id ORDER BY position, id) * 1000 + 1)::text, 12, '0') AS rank
+            FROM lists
+        ) AS ranked
+        WHERE lists.id = ranked.id
+    """)
+    op.execute("""
+        UPDATE cards SET rank = ranked.rank
+        FROM (
+            SELECT id, lpad((row_number() OVER (PARTITION BY list_id ORDER BY position, id) * 1000 + 1)::text, 12, '0') AS rank
+            FROM cards
+        ) AS ranked
+        WHERE cards.id = ranked.id
+    """)
+
+    op.drop_index('ix_lists_board_id_position', table_name='lists')
+    op.drop_index('ix_cards_list_id_position', table_name='cards')
+    op.create_index('ix_lists_board_id_rank', 'lists', ['board_id', 'rank'], unique=False)
+    op.create_index('ix_cards_list_id_rank', 'cards', ['list_id', 'rank'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_cards_list_id_rank', table_name='cards')
+    op.drop_index('ix_lists_board_id_rank', table_name='lists')
+    op.create_index('ix_cards_list_id_position', 'cards', ['list_id', 'position'], unique=False)
+    op.create_index('ix_lists_board_id_position', 'lists', ['board_id', 'position'], unique=False)
+    op.drop_column('cards', 'rank')
+    op.drop_column('lists', 'rank')
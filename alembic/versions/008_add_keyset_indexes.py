@@ -0,0 +1,31 @@
+"""extend rank indexes with id for keyset pagination
+
+Revision ID: 008
+Revises: 007
+Create Date: 2024-02-12 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Pages are keyed on (rank, id); with id in the index a page is a single
+    # index range scan even where several rows share a rank.
+    op.create_index('ix_lists_board_id_rank_id', 'lists', ['board_id', 'rank', 'id'], unique=False)
+    op.create_index('ix_cards_list_id_rank_id', 'cards', ['list_id', 'rank', 'id'], unique=False)
+    op.drop_index('ix_lists_board_id_rank', table_name='lists')
+    op.drop_index('ix_cards_list_id_rank', table_name='cards')
+
+
+def downgrade() -> None:
+    op.create_index('ix_cards_list_id_rank', 'cards', ['list_id', 'rank'], unique=False)
+    op.create_index('ix_lists_board_id_rank', 'lists', ['board_id', 'rank'], unique=False)
+    op.drop_index('ix_cards_list_id_rank_id', table_name='cards')
+    op.drop_index('ix_lists_board_id_rank_id', table_name='lists')
@@ -0,0 +1,25 @@
+"""add version counters to workspaces and boards
+
+Revision ID: 009
+Revises: 008
+Create Date: 2024-02-19 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('workspaces', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('boards', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('boards', 'version')
+    op.drop_column('workspaces', 'version')
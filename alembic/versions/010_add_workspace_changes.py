@@ -0,0 +1,39 @@
+"""add workspace change log
+
+Revision ID: 010
+Revises: 009
+Create Date: 2024-02-26 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('workspaces', sa.Column('change_seq', sa.Integer(), server_default='0', nullable=False))
+    op.create_table(
+        'workspace_changes',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('workspace_id', sa.Integer(), nullable=False),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['workspace_id'], ['workspaces.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_workspace_changes_workspace_id_seq', 'workspace_changes', ['workspace_id', 'seq'], unique=True)
+    op.create_index('ix_workspace_changes_created_at', 'workspace_changes', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_workspace_changes_created_at', table_name='workspace_changes')
+    op.drop_index('ix_workspace_changes_workspace_id_seq', table_name='workspace_changes')
+    op.drop_table('workspace_changes')
+    op.drop_column('workspaces', 'change_seq')
@@ -0,0 +1,33 @@
+"""add full-text search vector to cards
+
+Revision ID: 012
+Revises: 011
+Create Date: 2024-03-11 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # A stored generated column: Postgres keeps it in step with name and
+    # description on every write, and the GIN index serves @@ matches. Adding
+    # it rewrites the cards table, so schedule it on large databases.
+    op.execute(
+        "ALTER TABLE cards ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+        ") STORED"
+    )
+    op.create_index('ix_cards_search_vector', 'cards', ['search_vector'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_cards_search_vector', table_name='cards')
+    op.drop_column('cards', 'search_vector')
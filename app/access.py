@@ -0,0 +1,214 @@
+import os
+from typing import FrozenSet, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+import app.models as models
+from app.cache import TTLCache
+
+ACCESS_CACHE_TTL_SECONDS = float(os.getenv("ACCESS_CACHE_TTL_SECONDS", "30"))
+ACCESS_CACHE_MAX_USERS = int(os.getenv("ACCESS_CACHE_MAX_USERS", "10000"))
+
+# user_id -> frozenset of workspace ids the user owns or is a member of.
+# Shared across requests; the per-request copy lives in Session.info. Only
+# its positive answers are trusted: access granted on another worker (or
+# committed while a request was filling the entry) is missing from it, so a
+# workspace id it lacks is checked against the database.
+_workspace_access = TTLCache(ACCESS_CACHE_MAX_USERS, ACCESS_CACHE_TTL_SECONDS)
+_SESSION_KEY = "accessible_workspace_ids"
+
+
+def _accessible_query(user_id: int):
+    owned = select(models.Workspace.id).where(models.Workspace.owner_id == user_id)
+    joined = select(models.workspace_members.c.workspace_id).where(
+        models.workspace_members.c.user_id == user_id
+    )
+    return owned.union(joined)
+
+
+def _board_query(board_id: int):
+    return select(models.Board.workspace_id).where(models.Board.id == board_id)
+
+
+def _list_query(list_id: int, board_id: Optional[int]):
+    query = (
+        select(models.Board.workspace_id)
+        .join(models.List, models.List.board_id == models.Board.id)
+        .where(models.List.id == list_id)
+    )
+    if board_id is not None:
+        query = query.where(models.Board.id == board_id)
+    return query
+
+
+def _card_query(card_id: int, list_id: Optional[int]):
+    query = (
+        select(models.Board.workspace_id)
+        .join(models.List, models.List.board_id == models.Board.id)
+        .join(models.Card, models.Card.list_id == models.List.id)
+        .where(models.Card.id == card_id)
+    )
+    if list_id is not None:
+        query = query.where(models.Card.list_id == list_id)
+    return query
+
+
+def _card_for_update_query(card_id: int, list_id: int, target_list_id: int):
+    # The card row locked, plus the workspace of its list and of the list it
+    # is moving to (the same list if it is not moving), in one statement.
+    target_list = aliased(models.List)
+    target_board = aliased(models.Board)
+    return (
+        select(
+            models.Card,
+            models.Board.workspace_id,
+            target_board.workspace_id.label("target_workspace_id"),
+        )
+        .join(models.List, models.Card.list_id == models.List.id)
+        .join(models.Board, models.List.board_id == models.Board.id)
+        .outerjoin(target_list, target_list.id == target_list_id)
+        .outerjoin(target_board, target_board.id == target_list.board_id)
+        .where(models.Card.id == card_id, models.Card.list_id == list_id)
+        .with_for_update(of=models.Card)
+    )
+
+
+def _known(db, user_id: int) -> Tuple[Optional[FrozenSet[int]], bool]:
+    # The user's workspace ids and whether this session read them from the
+    # database; otherwise they come from the shared cache, or are None.
+    memo = db.info.get(_SESSION_KEY, {})
+    if user_id in memo:
+        return memo[user_id], True
+    return _workspace_access.get(user_id), False
+
+
+def _answer(db, user_id: int, workspace_ids) -> Optional[bool]:
+    # None when the database has to be asked.
+    known, loaded = _known(db, user_id)
+    if known is not None and set(workspace_ids) <= known:
+        return True
+    return False if loaded else None
+
+
+def _remember(db, user_id: int, workspace_ids) -> FrozenSet[int]:
+    workspace_ids = frozenset(workspace_ids)
+    # A replica may still trail the membership change that invalidated the
+    # shared entry, so what it returns is kept for this request only.
+    if not db.info.get("replica"):
+        _workspace_access.set(user_id, workspace_ids)
+    db.info.setdefault(_SESSION_KEY, {})[user_id] = workspace_ids
+    return workspace_ids
+
+
+def accessible_workspace_ids(db: Session, user_id: int) -> FrozenSet[int]:
+    # Listings need the complete set, which only the database has.
+    workspace_ids, loaded = _known(db, user_id)
+    if not loaded:
+        workspace_ids = _remember(db, user_id, db.scalars(_accessible_query(user_id)))
+    return workspace_ids
+
+
+def _has_access(db: Session, user_id: int, *workspace_ids: int) -> bool:
+    answer = _answer(db, user_id, workspace_ids)
+    if answer is None:
+        answer = set(workspace_ids) <= accessible_workspace_ids(db, user_id)
+    return answer
+
+
+def can_access_workspace(db: Session, user_id: int, workspace_id: int) -> bool:
+    return _has_access(db, user_id, workspace_id)
+
+
+def _checked(db: Session, user_id: int, workspace_id: Optional[int]):
+    if workspace_id is None or not can_access_workspace(db, user_id, workspace_id):
+        return None
+    return workspace_id
+
+
+def board_workspace_id(db: Session, board_id: int, user_id: int) -> Optional[int]:
+    return _checked(db, user_id, db.scalar(_board_query(board_id)))
+
+
+async def accessible_workspace_ids_async(
+    db: AsyncSession, user_id: int
+) -> FrozenSet[int]:
+    workspace_ids, loaded = _known(db, user_id)
+    if not loaded:
+        rows = await db.scalars(_accessible_query(user_id))
+        workspace_ids = _remember(db, user_id, rows)
+    return workspace_ids
+
+
+async def _has_access_async(db: AsyncSession, user_id: int, *workspace_ids: int):
+    answer = _answer(db, user_id, workspace_ids)
+    if answer is None:
+        answer = set(workspace_ids) <= await accessible_workspace_ids_async(
+            db, user_id
+        )
+    return answer
+
+
+async def can_access_workspace_async(
+    db: AsyncSession, user_id: int, workspace_id: int
+) -> bool:
+    return await _has_access_async(db, user_id, workspace_id)
+
+
+async def _checked_async(db: AsyncSession, user_id: int, workspace_id: Optional[int]):
+    if workspace_id is None or not await can_access_workspace_async(
+        db, user_id, workspace_id
+    ):
+        return None
+    return workspace_id
+
+
+async def board_workspace_id_async(
+    db: AsyncSession, board_id: int, user_id: int
+) -> Optional[int]:
+    return await _checked_async(db, user_id, await db.scalar(_board_query(board_id)))
+
+
+async def list_workspace_id_async(
+    db: AsyncSession, list_id: int, user_id: int, board_id: Optional[int] = None
+) -> Optional[int]:
+    workspace_id = await db.scalar(_list_query(list_id, board_id))
+    return await _checked_async(db, user_id, workspace_id)
+
+
+async def card_workspace_id_async(
+    db: AsyncSession, card_id: int, user_id: int, list_id: Optional[int] = None
+) -> Optional[int]:
+    workspace_id = await db.scalar(_card_query(card_id, list_id))
+    return await _checked_async(db, user_id, workspace_id)
+
+
+async def card_for_update_async(
+    db: AsyncSession, card_id: int, list_id: int, target_list_id: int, user_id: int
+):
+    """Lock the card; returns (Card, workspace_id, target_workspace_id), or
+    None if the card or target list is missing or not accessible."""
+    query = _card_for_update_query(card_id, list_id, target_list_id)
+    row = (await db.execute(query)).first()
+    if row is None or row.target_workspace_id is None:
+        return None
+    if not await _has_access_async(
+        db, user_id, row.workspace_id, row.target_workspace_id
+    ):
+        return None
+    return row
+
+
+def invalidate_user(db, user_id: int):
+    db.info.get(_SESSION_KEY, {}).pop(user_id, None)
+    _workspace_access.pop(user_id)
+
+
+def invalidate_workspace(db, workspace_id: int):
+    db.info.pop(_SESSION_KEY, None)
+    _workspace_access.discard_where(lambda workspace_ids: workspace_id in workspace_ids)
+
+
+def cache_stats():
+    return _workspace_access.stats()
@@ -0,0 +1,388 @@
+from typing import Optional
+
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+import app.access as access
+import app.changes as changes
+import app.models as models
+import app.ranking as ranking
+import app.schemas as schemas
+import app.versions as versions
+
+# Data access for the async routes, on an AsyncSession so database
+# round-trips never block the event loop. Every write the API performs lives
+# here; app.crud keeps the sync reads and the rank rebalances that background
+# tasks run in the threadpool.
+
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(
+        select(models.User).where(func.lower(models.User.email) == email.lower())
+    )
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
+    db_user = models.User(
+        username=user.username,
+        email=user.email.lower(),
+        hashed_password=hashed_password,
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+
+async def update_password_hash(db: AsyncSession, user: models.User, hashed_password: str):
+    user.hashed_password = hashed_password
+    await db.commit()
+
+
+async def set_user_active(
+    db: AsyncSession, user_id: int, is_active: bool
+) -> Optional[str]:
+    """Returns the user's email, or None if there is no such user."""
+    email = await db.scalar(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(is_active=is_active)
+        .returning(models.User.email)
+    )
+    await db.commit()
+    return email
+
+
+async def create_workspace(
+    db: AsyncSession, workspace: schemas.WorkspaceCreate, user_id: int
+):
+    db_workspace = models.Workspace(**workspace.dict(), owner_id=user_id)
+    db.add(db_workspace)
+    await db.flush()
+    await changes.record_async(
+        db, db_workspace.id, "workspace_created", db_workspace.to_dict()
+    )
+    await db.commit()
+    await db.refresh(db_workspace)
+    # A new workspace has no members; mark the collection loaded so the
+    # response model does not trigger a lazy load.
+    set_committed_value(db_workspace, "members", [])
+    access.invalidate_user(db, user_id)
+    return db_workspace
+
+
+async def get_owned_workspace(db: AsyncSession, workspace_id: int, user_id: int):
+    return await db.scalar(
+        select(models.Workspace).where(
+            models.Workspace.id == workspace_id, models.Workspace.owner_id == user_id
+        )
+    )
+
+
+async def delete_workspace(db: AsyncSession, workspace_id: int, user_id: int) -> bool:
+    if not await get_owned_workspace(db, workspace_id, user_id):
+        return False
+    result = await db.execute(
+        delete(models.Workspace).where(models.Workspace.id == workspace_id)
+    )
+    await db.commit()
+    access.invalidate_workspace(db, workspace_id)
+    return result.rowcount > 0
+
+
+async def add_member_to_workspace(db: AsyncSession, workspace_id: int, user_id: int):
+    existing = await db.scalar(
+        select(models.workspace_members.c.user_id).where(
+            models.workspace_members.c.workspace_id == workspace_id,
+            models.workspace_members.c.user_id == user_id,
+        )
+    )
+    if existing is None:
+        await db.execute(
+            models.workspace_members.insert().values(
+                workspace_id=workspace_id, user_id=user_id
+            )
+        )
+        await versions.bump_workspace_async(db, workspace_id)
+        user = await db.get(models.User, user_id)
+        await changes.record_async(
+            db,
+            workspace_id,
+            "member_added",
+            schemas.User.model_validate(user).model_dump(mode="json"),
+        )
+        await db.commit()
+        access.invalidate_user(db, user_id)
+    return True
+
+
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+
+async def create_board(db: AsyncSession, board: schemas.BoardCreate, workspace_id: int):
+    db_board = models.Board(**board.dict(), workspace_id=workspace_id)
+    db.add(db_board)
+    await db.flush()
+    await versions.bump_workspace_async(db, workspace_id)
+    await changes.record_async(db, workspace_id, "board_created", db_board.to_dict())
+    await db.commit()
+    await db.refresh(db_board)
+    return db_board
+
+
+async def _rank_for_position(db: AsyncSession, model, where, position):
+    ranks = []
+    if position is not None:
+        ranks = (
+            await db.scalars(
+                ranking.neighbours_query(model.rank, model.id, where, position)
+            )
+        ).all()
+    last_rank = None
+    if not ranks and (position is None or position > 0):
+        last_rank = await db.scalar(ranking.last_rank_query(model.rank, where))
+    return ranking.rank_for_position(position, ranks, last_rank)
+
+
+async def create_list(db: AsyncSession, list_item: schemas.ListCreate, board_id: int):
+    rank = await _rank_for_position(
+        db, models.List, [models.List.board_id == board_id], list_item.position
+    )
+    db_list = models.List(**list_item.dict(), board_id=board_id, rank=rank)
+    db.add(db_list)
+    await db.flush()
+    await versions.bump_board_async(db, board_id)
+    await changes.record_async(
+        db, changes.board_workspace(board_id), "list_created", db_list.to_dict()
+    )
+    await db.commit()
+    await db.refresh(db_list)
+    return db_list
+
+
+async def delete_list(
+    db: AsyncSession, list_id: int, user_id: int, board_id: int
+) -> bool:
+    workspace_id = await access.list_workspace_id_async(
+        db, list_id, user_id, board_id=board_id
+    )
+    if workspace_id is None:
+        return False
+    result = await db.execute(delete(models.List).where(models.List.id == list_id))
+    await versions.bump_board_async(db, board_id)
+    await changes.record_async(
+        db, workspace_id, "list_deleted", {"list_id": list_id, "board_id": board_id}
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def create_card(db: AsyncSession, card: schemas.CardCreate, list_id: int):
+    rank = await _rank_for_position(
+        db, models.Card, [models.Card.list_id == list_id], card.position
+    )
+    db_card = models.Card(**card.dict(), list_id=list_id, rank=rank)
+    db.add(db_card)
+    await db.flush()
+    await versions.bump_list_boards_async(db, list_id)
+    await changes.record_async(
+        db, changes.list_workspace(list_id), "card_created", db_card.to_dict()
+    )
+    await db.commit()
+    await db.refresh(db_card)
+    return db_card
+
+
+async def update_card(
+    db: AsyncSession,
+    card_id: int,
+    list_id: int,
+    card_update: schemas.CardUpdate,
+    user_id: int,
+):
+    target_list_id = card_update.list_id or list_id
+    row = await access.card_for_update_async(
+        db, card_id, list_id, target_list_id, user_id
+    )
+    if row is None:
+        return None
+    card = row.Card
+    if card_update.version is not None and card_update.version != card.version:
+        await db.rollback()
+        raise versions.VersionConflict(card.version)
+
+    moved = target_list_id != list_id
+    if moved:
+        card.list_id = target_list_id
+
+    if moved or card_update.position is not None:
+        card.rank = await _rank_for_position(
+            db,
+            models.Card,
+            [models.Card.list_id == card.list_id, models.Card.id != card.id],
+            card_update.position,
+        )
+    if card_update.position is not None:
+        card.position = card_update.position
+    if card_update.name is not None:
+        card.name = card_update.name
+    if card_update.description is not None:
+        card.description = card_update.description
+    card.version = card.version + 1
+
+    await db.flush()
+    await versions.bump_list_boards_async(db, list_id, card.list_id)
+    if row.target_workspace_id != row.workspace_id:
+        # Into another workspace: each log (and board cache) sees the card
+        # leave or arrive, and the target's change_seq moves with it.
+        await changes.lock_workspaces_async(
+            db, row.workspace_id, row.target_workspace_id
+        )
+        await changes.record_async(
+            db,
+            row.workspace_id,
+            "card_deleted",
+            {"card_id": card.id, "list_id": list_id},
+        )
+        await changes.record_async(
+            db, row.target_workspace_id, "card_created", card.to_dict()
+        )
+    else:
+        await changes.record_async(
+            db, row.workspace_id, "card_updated", card.to_dict()
+        )
+    await db.commit()
+    # Every column was set above and expire_on_commit is off: no refresh.
+    return card
+
+
+async def delete_card(
+    db: AsyncSession, card_id: int, user_id: int, list_id: int
+) -> bool:
+    workspace_id = await access.card_workspace_id_async(
+        db, card_id, user_id, list_id=list_id
+    )
+    if workspace_id is None:
+        return False
+    await versions.bump_list_boards_async(db, list_id)
+    result = await db.execute(delete(models.Card).where(models.Card.id == card_id))
+    await changes.record_async(
+        db, workspace_id, "card_deleted", {"card_id": card_id, "list_id": list_id}
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def _rank_after(db: AsyncSession, model, parent_clause, item_id, after_id):
+    # Rank between ``after_id`` (None: the top) and the item currently following
+    # it among the rows matching parent_clause, ignoring the item being moved.
+    where = [parent_clause, model.id != item_id]
+    if after_id is None:
+        first = await db.scalar(
+            select(model.rank).where(*where).order_by(model.rank, model.id).limit(1)
+        )
+        return ranking.rank_between(None, first)
+    after_rank = await db.scalar(
+        select(model.rank).where(*where, model.id == after_id)
+    )
+    if after_rank is None:
+        return None
+    following = await db.scalar(
+        select(model.rank)
+        .where(*where, tuple_(model.rank, model.id) > tuple_(after_rank, after_id))
+        .order_by(model.rank, model.id)
+        .limit(1)
+    )
+    return ranking.rank_between(after_rank, following)
+
+
+async def reorder_board(db: AsyncSession, board_id: int, reorder: schemas.BoardReorder):
+    """Apply every move in one transaction, one row update per move.
+
+    Returns the moved lists and cards, or None (nothing written) when a move
+    references a list or card outside the board.
+    """
+    board_list_ids = set(
+        (
+            await db.scalars(
+                select(models.List.id).where(models.List.board_id == board_id)
+            )
+        ).all()
+    )
+    card_ids = {move.card_id for move in reorder.cards}
+    cards = {
+        card.id: card
+        for card in (
+            await db.scalars(
+                select(models.Card)
+                .where(
+                    models.Card.id.in_(card_ids),
+                    models.Card.list_id.in_(board_list_ids),
+                )
+                .with_for_update()
+            )
+        ).all()
+    }
+    list_ids = {move.list_id for move in reorder.lists}
+    lists = {
+        list_item.id: list_item
+        for list_item in (
+            await db.scalars(
+                select(models.List)
+                .where(models.List.id.in_(list_ids & board_list_ids))
+                .with_for_update()
+            )
+        ).all()
+    }
+    if len(cards) != len(card_ids) or len(lists) != len(list_ids):
+        return None
+
+    for move in reorder.lists:
+        rank = await _rank_after(
+            db,
+            models.List,
+            models.List.board_id == board_id,
+            move.list_id,
+            move.after_list_id,
+        )
+        if rank is None:
+            await db.rollback()
+            return None
+        lists[move.list_id].rank = rank
+        await db.flush()
+
+    for move in reorder.cards:
+        if move.list_id not in board_list_ids:
+            await db.rollback()
+            return None
+        rank = await _rank_after(
+            db,
+            models.Card,
+            models.Card.list_id == move.list_id,
+            move.card_id,
+            move.after_card_id,
+        )
+        if rank is None:
+            await db.rollback()
+            return None
+        card = cards[move.card_id]
+        card.list_id = move.list_id
+        card.rank = rank
+        card.version = card.version + 1
+        await db.flush()
+
+    await versions.bump_board_async(db, board_id)
+    await changes.record_async(
+        db,
+        changes.board_workspace(board_id),
+        "board_reordered",
+        {
+            "board_id": board_id,
+            "lists": [list_item.to_dict() for list_item in lists.values()],
+            "cards": [card.to_dict() for card in cards.values()],
+        },
+    )
+    await db.commit()
+    return list(lists.values()), list(cards.values())
@@ -1,14 +1,17 @@
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from . import crud, schemas
+from . import async_crud, crud, hashing, schemas
+from .cache import TTLCache
 from .database import get_db
+from .hashing import pwd_context
 
 # to get a string like this run:
 # openssl rand -hex 32
@@ -16,45 +19,91 @@ SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 43200  # 30 days to persist login across refreshes and sessions
 
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# token subject -> schemas.User snapshot of an active user. Deactivation
+# evicts the entry on every worker (revoke_principal).
+_principals = TTLCache(PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL_SECONDS)
 
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+def _token_subject(token: str) -> Optional[str]:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
+
+
 def get_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
+    email = _token_subject(token)
+    if email is None:
+        raise credentials_exception
+    principal = _principals.get(email)
+    if principal is None:
         user = crud.get_user_by_email(db, email=email)
-        if user is None:
+        if user is None or not user.is_active:
             raise credentials_exception
-        return user
-    except JWTError:
-        raise credentials_exception
+        principal = schemas.User.model_validate(user)
+        _principals.set(email, principal)
+    return principal
+
+
+async def get_user_async(db: AsyncSession, token: Optional[str]):
+    """get_user for WebSockets, which take the token as a query parameter
+    (browsers cannot set headers on them): the principal, or None."""
+    email = _token_subject(token) if token else None
+    if email is None:
+        return None
+    principal = _principals.get(email)
+    if principal is None:
+        user = await async_crud.get_user_by_email(db, email)
+        if user is None or not user.is_active:
+            return None
+        principal = schemas.User.model_validate(user)
+        _principals.set(email, principal)
+    return principal
+
+
+PRINCIPAL_TOPIC = "principal"
+
+
+def invalidate_principal(email: str):
+    _principals.pop(email)
+
+
+async def revoke_principal(email: str):
+    """Evict the user's cached principal on every worker, over the backplane."""
+    from app.websocket import manager
+
+    await manager.backplane.announce(PRINCIPAL_TOPIC, email)
+
+
+def principal_cache_stats():
+    return _principals.stats()
 
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = crud.get_user_by_email(db, email)
+async def authenticate_user_async(db: AsyncSession, email: str, password: str):
+    user = await async_crud.get_user_by_email(db, email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await hashing.verify_and_update(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        # The configured BCRYPT_ROUNDS changed since this hash was made.
+        await async_crud.update_password_hash(db, user, new_hash)
     return user
 
 
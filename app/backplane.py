@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Set
+
+BROADCAST_BACKPLANE = os.getenv("BROADCAST_BACKPLANE", "memory")
+
+# NOTIFY payloads must stay under 8000 bytes. Chunks are cut by characters, and
+# a character is at most 4 bytes in UTF-8, which leaves room for the header.
+NOTIFY_MAX_BYTES = 7500
+NOTIFY_CHUNK_CHARS = NOTIFY_MAX_BYTES // 4
+# Channel of announcements (see Backplane.announce), shared by all workspaces.
+EVENTS_CHANNEL = "backplane_events"
+PARTIAL_MESSAGE_TTL_SECONDS = 30
+# Upper bound of the doubling delay between attempts to restore a lost LISTEN
+# connection.
+BACKPLANE_RECONNECT_MAX_SECONDS = int(
+    os.getenv("BACKPLANE_RECONNECT_MAX_SECONDS", "30")
+)
+
+
+class Backplane(ABC):
+    """Carries broadcasts between workers; each worker fans out to its own sockets."""
+
+    def __init__(self):
+        self.deliver: Callable[[int, str], None] = None
+        # topic -> callback run on every worker for each value announced
+        self.listeners: Dict[str, Callable[[str], None]] = {}
+
+    def listen(self, topic: str, callback: Callable[[str], None]):
+        self.listeners[topic] = callback
+
+    def subscribe(self, workspace_id: int):
+        pass
+
+    def unsubscribe(self, workspace_id: int):
+        pass
+
+    @abstractmethod
+    async def publish(self, workspace_id: int, message: str):
+        """Deliver ``message`` to the ``workspace_id`` sockets of every worker."""
+
+    @abstractmethod
+    async def announce(self, topic: str, value: str):
+        """Run the ``topic`` listener with ``value`` on every worker, this one
+        included (e.g. to evict a cache entry everywhere)."""
+
+
+class InProcessBackplane(Backplane):
+    async def publish(self, workspace_id: int, message: str):
+        self.deliver(workspace_id, message)
+
+    async def announce(self, topic: str, value: str):
+        self.listeners[topic](value)
+
+
+class PostgresBackplane(Backplane):
+    """LISTEN/NOTIFY on the application database, one channel per workspace."""
+
+    def __init__(self):
+        super().__init__()
+        self.origin = uuid.uuid4().hex[:12]
+        self.channels: Set[int] = set()
+        self.logger = logging.getLogger(__name__)
+        self._connection = None
+        self._listening: Set[str] = set()
+        self._fd = None
+        self._loop = None
+        self._sync_task = None
+        self._dirty = False
+        self._partial: Dict[str, List] = {}
+
+    @staticmethod
+    def channel(workspace_id: int) -> str:
+        return f"ws_{int(workspace_id)}"
+
+    def listen(self, topic: str, callback: Callable[[str], None]):
+        super().listen(topic, callback)
+        self._schedule_sync()
+
+    def subscribe(self, workspace_id: int):
+        self.channels.add(workspace_id)
+        self._schedule_sync()
+
+    def unsubscribe(self, workspace_id: int):
+        self.channels.discard(workspace_id)
+        self._schedule_sync()
+
+    async def publish(self, workspace_id: int, message: str):
+        # Local sockets are served directly; other workers get it via NOTIFY.
+        self.deliver(workspace_id, message)
+        await asyncio.to_thread(self._notify, workspace_id, message)
+
+    async def announce(self, topic: str, value: str):
+        self.listeners[topic](value)
+        await asyncio.to_thread(
+            self._send, EVENTS_CHANNEL, f"{self.origin}:{topic}:{value}"
+        )
+
+    def _send(self, channel: str, payload: str):
+        from sqlalchemy import text
+
+        from app.database import engine
+
+        with engine.begin() as connection:
+            connection.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": channel, "payload": payload},
+            )
+
+    def _notify(self, workspace_id: int, message: str):
+        from sqlalchemy import text
+
+        from app.database import engine
+
+        if len(message.encode()) <= NOTIFY_MAX_BYTES:
+            chunks = [message]
+        else:
+            chunks = [
+                message[i : i + NOTIFY_CHUNK_CHARS]
+                for i in range(0, len(message), NOTIFY_CHUNK_CHARS)
+            ]
+        message_id = uuid.uuid4().hex[:12]
+        # One transaction: Postgres delivers its notifications together and in
+        # order, so chunks of different messages never interleave.
+        with engine.begin() as connection:
+            for index, chunk in enumerate(chunks):
+                connection.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {
+                        "channel": self.channel(workspace_id),
+                        "payload": f"{self.origin}:{message_id}:{index}:{len(chunks)}:{chunk}",
+                    },
+                )
+
+    def _schedule_sync(self):
+        # The LISTEN connection is driven from one task so that connecting and
+        # (UN)LISTEN run off the event loop and in order. It syncs to
+        # self.channels (and self.listeners) as of its last pass, however
+        # often they changed.
+        self._dirty = True
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.get_running_loop().create_task(self._sync())
+
+    async def _sync(self):
+        delay = 0.5
+        while self._dirty:
+            self._dirty = False
+            try:
+                channels = {self.channel(id_) for id_ in self.channels}
+                if self.listeners:
+                    channels.add(EVENTS_CHANNEL)
+                if self._connection is None and channels:
+                    await self._connect()
+                if self._connection is not None:
+                    await asyncio.to_thread(self._listen, channels)
+            except Exception:
+                self.logger.exception(
+                    f"Backplane LISTEN failed, retrying in {delay:g}s"
+                )
+                self._disconnect()
+                self._dirty = True
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, BACKPLANE_RECONNECT_MAX_SECONDS)
+
+    async def _connect(self):
+        import psycopg2
+
+        from app.database import engine
+
+        dsn = engine.url.set(drivername="postgresql").render_as_string(
+            hide_password=False
+        )
+        connection = await asyncio.to_thread(psycopg2.connect, dsn)
+        connection.autocommit = True
+        self._connection = connection
+        self._listening = set()
+        self._fd = connection.fileno()
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._fd, self._on_readable)
+
+    def _listen(self, channels: Set[str]):
+        # Runs in a worker thread.
+        with self._connection.cursor() as cursor:
+            for channel in channels - self._listening:
+                cursor.execute(f"LISTEN {channel}")
+                self._listening.add(channel)
+            for channel in self._listening - channels:
+                cursor.execute(f"UNLISTEN {channel}")
+                self._listening.discard(channel)
+
+    def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            self._loop.remove_reader(self._fd)
+            connection.close()
+
+    def _on_readable(self):
+        try:
+            self._connection.poll()
+        except Exception:
+            # Notifications sent until the new connection is listening are lost.
+            self.logger.exception("Backplane connection lost, reconnecting")
+            self._disconnect()
+            self._schedule_sync()
+            return
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            self._receive(notify.channel, notify.payload)
+
+    def _receive(self, channel: str, payload: str):
+        if channel == EVENTS_CHANNEL:
+            origin, topic, value = payload.split(":", 2)
+            if origin != self.origin and topic in self.listeners:
+                self.listeners[topic](value)
+            return
+        origin, message_id, index, total, chunk = payload.split(":", 4)
+        if origin == self.origin:
+            return
+        workspace_id = int(channel[len("ws_") :])
+        total = int(total)
+        if total == 1:
+            self.deliver(workspace_id, chunk)
+            return
+        now = time.monotonic()
+        parts = self._partial.setdefault(message_id, [now, [None] * total])[1]
+        parts[int(index)] = chunk
+        if None not in parts:
+            del self._partial[message_id]
+            self.deliver(workspace_id, "".join(parts))
+        for stale in [
+            key
+            for key, (started, _) in self._partial.items()
+            if now - started > PARTIAL_MESSAGE_TTL_SECONDS
+        ]:
+            del self._partial[stale]
+
+
+def create_backplane() -> Backplane:
+    if BROADCAST_BACKPLANE == "postgres":
+        return PostgresBackplane()
+    if BROADCAST_BACKPLANE == "memory":
+        return InProcessBackplane()
+    raise ValueError(
+        f"Unknown BROADCAST_BACKPLANE {BROADCAST_BACKPLANE!r}; use 'memory' or 'postgres'"
+    )
@@ -0,0 +1,429 @@
+import logging
+import os
+import sys
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import BackgroundTasks, HTTPException
+from sqlalchemy import select
+
+import app.crud as crud
+import app.models as models
+from app.cache import TTLCache
+from app.database import SessionLocal
+
+BOARD_CACHE = os.getenv("BOARD_CACHE", "true").lower() == "true"
+BOARD_CACHE_MAX_BYTES = int(os.getenv("BOARD_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# A cached workspace further behind than this many events is reloaded
+# rather than caught up from the change log.
+BOARD_CACHE_MAX_CATCH_UP = int(os.getenv("BOARD_CACHE_MAX_CATCH_UP", "200"))
+
+# Each worker keeps the boards, lists and cards of recently read workspaces,
+# as the rows the read routes return, tagged with the workspace change_seq
+# they reflect. The version query every read route already runs returns the
+# workspace's current change_seq too, and a cached copy is only served when
+# it is at least that recent, so a missed event can make the cache slower
+# but never stale.
+#
+# Copies are kept current by the events the routes record: changes.publish
+# applies each committed event here, in seq order, before broadcasting it.
+# Events committed by other workers are not seen that way; a copy that is
+# behind is brought up to date from the workspace change log (one query) on
+# the read that finds it behind. A workspace that is not cached is read from
+# the database and loaded by a background task after the response.
+
+_BOARD_FIELDS = tuple(column.key for column in crud.BOARD_COLUMNS)
+_LIST_FIELDS = tuple(column.key for column in crud.LIST_COLUMNS)
+_CARD_FIELDS = tuple(column.key for column in crud.CARD_COLUMNS)
+# Events that change nothing cached; they only advance the seq.
+_IGNORED_EVENTS = {"workspace_created", "member_added"}
+
+logger = logging.getLogger(__name__)
+
+
+def rank_key(row: dict):
+    return (row["rank"], row["id"])
+
+
+def _size(row: dict) -> int:
+    # Field names are interned and small ints are shared, so the dict and
+    # its strings are what each row adds.
+    return sys.getsizeof(row) + sum(
+        sys.getsizeof(value) for value in row.values() if isinstance(value, str)
+    )
+
+
+class _Workspace:
+    """One workspace's boards, lists and cards as of change ``seq``."""
+
+    def __init__(self, seq: int):
+        self.seq = seq
+        self.bytes = 0
+        self.boards = {}
+        self.lists = {}
+        self.cards = {}
+        # Parent id -> child ids, and parent -> children sorted by rank,
+        # built on first read and dropped when one of them changes.
+        self.children = {"lists": {}, "cards": {}}
+        self.ordered = {}
+
+    def _put(self, table: dict, fields, row: dict) -> Optional[dict]:
+        row = {name: row[name] for name in fields}
+        old = table.get(row["id"])
+        if old is not None:
+            self.bytes -= _size(old)
+        table[row["id"]] = row
+        self.bytes += _size(row)
+        return old
+
+    def _link(self, kind: str, parent_id: int, child_id: int, add: bool):
+        children = self.children[kind].setdefault(parent_id, set())
+        if add:
+            children.add(child_id)
+        else:
+            children.discard(child_id)
+        self.ordered.pop((kind, parent_id), None)
+
+    def put_board(self, row: dict):
+        self._put(self.boards, _BOARD_FIELDS, row)
+
+    def put_list(self, row: dict):
+        old = self._put(self.lists, _LIST_FIELDS, row)
+        if old is not None:
+            self._link("lists", old["board_id"], old["id"], False)
+        self._link("lists", row["board_id"], row["id"], True)
+
+    def put_card(self, row: dict):
+        old = self._put(self.cards, _CARD_FIELDS, row)
+        if old is not None:
+            self._link("cards", old["list_id"], old["id"], False)
+        self._link("cards", row["list_id"], row["id"], True)
+
+    def delete_card(self, card_id: int):
+        row = self.cards.pop(card_id, None)
+        if row is not None:
+            self.bytes -= _size(row)
+            self._link("cards", row["list_id"], card_id, False)
+
+    def delete_list(self, list_id: int):
+        row = self.lists.pop(list_id, None)
+        if row is not None:
+            self.bytes -= _size(row)
+            self._link("lists", row["board_id"], list_id, False)
+        # The cards went with it (ON DELETE CASCADE).
+        for card_id in list(self.children["cards"].get(list_id, ())):
+            self.delete_card(card_id)
+        self.children["cards"].pop(list_id, None)
+
+    def apply(self, event_type: str, payload: dict) -> bool:
+        """Apply one event; False if it is not one this cache understands."""
+        if event_type == "board_created":
+            self.put_board(payload)
+        elif event_type == "list_created":
+            self.put_list(payload)
+        elif event_type == "list_deleted":
+            self.delete_list(payload["list_id"])
+        elif event_type in ("card_created", "card_updated"):
+            self.put_card(payload)
+        elif event_type == "card_deleted":
+            self.delete_card(payload["card_id"])
+        elif event_type == "board_reordered":
+            for row in payload["lists"]:
+                self.put_list(row)
+            for row in payload["cards"]:
+                self.put_card(row)
+        elif event_type not in _IGNORED_EVENTS:
+            return False
+        return True
+
+    def sorted_children(self, kind: str, parent_id: int) -> list:
+        rows = self.ordered.get((kind, parent_id))
+        if rows is None:
+            table = self.lists if kind == "lists" else self.cards
+            rows = sorted(
+                (table[i] for i in self.children[kind].get(parent_id, ())),
+                key=rank_key,
+            )
+            self.ordered[kind, parent_id] = rows
+        return rows
+
+
+def _changes_query(workspace_id: int, since: int, until: int):
+    return (
+        select(
+            models.WorkspaceChange.seq,
+            models.WorkspaceChange.type,
+            models.WorkspaceChange.payload,
+        )
+        .where(
+            models.WorkspaceChange.workspace_id == workspace_id,
+            models.WorkspaceChange.seq > since,
+            models.WorkspaceChange.seq <= until,
+        )
+        .order_by(models.WorkspaceChange.seq)
+    )
+
+
+def _load(db, workspace_id: int) -> Optional[_Workspace]:
+    seq = db.scalar(
+        select(models.Workspace.change_seq).where(models.Workspace.id == workspace_id)
+    )
+    if seq is None:
+        return None
+    in_workspace = models.Board.workspace_id == workspace_id
+    board_ids = select(models.Board.id).where(in_workspace)
+    list_ids = select(models.List.id).where(models.List.board_id.in_(board_ids))
+    entry = _Workspace(seq)
+    for put, columns, where in (
+        (entry.put_board, crud.BOARD_COLUMNS, in_workspace),
+        (entry.put_list, crud.LIST_COLUMNS, models.List.id.in_(list_ids)),
+        (entry.put_card, crud.CARD_COLUMNS, models.Card.list_id.in_(list_ids)),
+    ):
+        for row in db.execute(select(*columns).where(where)):
+            put(row._asdict())
+    return entry
+
+
+class BoardCache:
+    """LRU over workspaces, bounded by the estimated bytes of their rows."""
+
+    def __init__(self, max_bytes: int = BOARD_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.catch_ups = 0
+        self.loads = 0
+        self.evictions = 0
+        self.events_applied = 0
+        self._workspaces: "OrderedDict[int, _Workspace]" = OrderedDict()
+        self._loading = set()
+        # Workspaces too large to cache, not worth loading again for a while.
+        self._uncacheable = TTLCache(1024, 300)
+        self._lock = threading.Lock()
+
+    def _store(self, workspace_id: int, entry: _Workspace):
+        old = self._workspaces.pop(workspace_id, None)
+        if old is not None:
+            self.bytes -= old.bytes
+        self._workspaces[workspace_id] = entry
+        self.bytes += entry.bytes
+        self._evict()
+
+    def _evict(self):
+        # Least recently read first; the newest copy stays even if alone it
+        # is over the limit, which load() keeps from happening.
+        while self.bytes > self.max_bytes and len(self._workspaces) > 1:
+            _, evicted = self._workspaces.popitem(last=False)
+            self.bytes -= evicted.bytes
+            self.evictions += 1
+
+    def _drop(self, workspace_id: int):
+        entry = self._workspaces.pop(workspace_id, None)
+        if entry is not None:
+            self.bytes -= entry.bytes
+
+    def _apply(self, workspace_id: int, entry: _Workspace, events):
+        before = entry.bytes
+        for seq, event_type, payload in events:
+            if seq <= entry.seq:
+                continue
+            if seq != entry.seq + 1:
+                # A gap: left behind until a read catches it up from the log.
+                break
+            try:
+                applied = entry.apply(event_type, payload)
+            except KeyError:
+                # Logged before a field the cache needs existed.
+                applied = False
+            if not applied:
+                self.bytes += entry.bytes - before
+                self._drop(workspace_id)
+                return
+            entry.seq = seq
+            self.events_applied += 1
+        self.bytes += entry.bytes - before
+        self._workspaces.move_to_end(workspace_id)
+        self._evict()
+
+    def apply(self, workspace_id: int, seq: int, event_type: str, payload: dict):
+        """Apply a committed event to the workspace's copy, if it is cached."""
+        with self._lock:
+            entry = self._workspaces.get(workspace_id)
+            if entry is not None:
+                self._apply(workspace_id, entry, [(seq, event_type, payload)])
+
+    def discard(self, workspace_id: int):
+        with self._lock:
+            self._drop(workspace_id)
+
+    def _read(self, db, current, background_tasks: BackgroundTasks, build):
+        """build(entry) from a copy at least as recent as ``current`` (a row
+        from versions.board_version and friends), or None to use the database.
+        """
+        if not BOARD_CACHE:
+            return None
+        workspace_id, change_seq = current.workspace_id, current.change_seq
+        with self._lock:
+            entry = self._workspaces.get(workspace_id)
+            if entry is not None and entry.seq >= change_seq:
+                self._workspaces.move_to_end(workspace_id)
+                self.hits += 1
+                return build(entry)
+            since = None
+            behind = None if entry is None else change_seq - entry.seq
+            if behind is not None and behind <= BOARD_CACHE_MAX_CATCH_UP:
+                since = entry.seq
+        if since is not None:
+            events = db.execute(_changes_query(workspace_id, since, change_seq)).all()
+            with self._lock:
+                entry = self._workspaces.get(workspace_id)
+                if entry is not None:
+                    self._apply(workspace_id, entry, events)
+                    if workspace_id in self._workspaces and entry.seq >= change_seq:
+                        self.hits += 1
+                        self.catch_ups += 1
+                        return build(entry)
+        with self._lock:
+            self.misses += 1
+            if workspace_id in self._loading or self._uncacheable.get(workspace_id):
+                return None
+            self._loading.add(workspace_id)
+        background_tasks.add_task(self.load, workspace_id)
+        return None
+
+    def load(self, workspace_id: int):
+        """Read the workspace from the primary into the cache, in one snapshot."""
+        try:
+            with SessionLocal() as db:
+                db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+                entry = _load(db, workspace_id)
+        except Exception:
+            logger.exception(f"Loading workspace {workspace_id} into the cache failed")
+            entry = None
+        with self._lock:
+            self._loading.discard(workspace_id)
+            if entry is None:
+                return
+            uncacheable = entry.bytes > self.max_bytes // 4 or any(
+                row["rank"] is None
+                for row in (*entry.lists.values(), *entry.cards.values())
+            )
+            if uncacheable:
+                self._uncacheable.set(workspace_id, True)
+                return
+            existing = self._workspaces.get(workspace_id)
+            if existing is None or existing.seq < entry.seq:
+                self._store(workspace_id, entry)
+                self.loads += 1
+
+    def boards(self, db, current, background_tasks):
+        return self._read(
+            db, current, background_tasks, lambda entry: list(entry.boards.values())
+        )
+
+    def board(self, db, current, board_id: int, background_tasks):
+        return self._read(
+            db, current, background_tasks, lambda entry: entry.boards.get(board_id)
+        )
+
+    def lists(self, db, current, board_id: int, background_tasks):
+        return self._read(
+            db,
+            current,
+            background_tasks,
+            lambda entry: entry.sorted_children("lists", board_id),
+        )
+
+    def cards(self, db, current, list_id: int, background_tasks):
+        return self._read(
+            db,
+            current,
+            background_tasks,
+            lambda entry: entry.sorted_children("cards", list_id),
+        )
+
+    def board_full(self, db, current, board_id: int, background_tasks):
+        def build(entry):
+            board = entry.boards.get(board_id)
+            if board is None:
+                return None
+            return {
+                **board,
+                "lists": [
+                    {**row, "cards": entry.sorted_children("cards", row["id"])}
+                    for row in entry.sorted_children("lists", board_id)
+                ],
+            }
+
+        return self._read(db, current, background_tasks, build)
+
+    def check(self, db, workspace_id: int) -> list:
+        """Differences between the cached copy and the database; the load
+        benchmark expects none after each scenario.
+
+        Empty when they agree or the workspace is not cached. Compare with
+        no writes in flight and after their events have been published.
+        """
+        with self._lock:
+            entry = self._workspaces.get(workspace_id)
+            if entry is None:
+                return []
+            cached = {
+                "board": dict(entry.boards),
+                "list": dict(entry.lists),
+                "card": dict(entry.cards),
+            }
+            seq = entry.seq
+        fresh = _load(db, workspace_id)
+        if fresh is None:
+            return [f"workspace {workspace_id} is cached but not in the database"]
+        problems = []
+        if fresh.seq != seq:
+            problems.append(f"cached at seq {seq}, database is at {fresh.seq}")
+        for kind, rows in (
+            ("board", fresh.boards),
+            ("list", fresh.lists),
+            ("card", fresh.cards),
+        ):
+            for row_id in sorted(rows.keys() | cached[kind].keys()):
+                mine, theirs = cached[kind].get(row_id), rows.get(row_id)
+                if mine != theirs:
+                    problems.append(
+                        f"{kind} {row_id}: cached {mine}, database {theirs}"
+                    )
+        return problems
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": BOARD_CACHE,
+                "workspaces": len(self._workspaces),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "catch_ups": self.catch_ups,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "events_applied": self.events_applied,
+            }
+
+
+def page_of(rows: list, page) -> list:
+    """The rows Page.apply would select, from rows sorted by rank_key."""
+    start = 0
+    if page.after is not None:
+        page.check_after((str, int))
+        try:
+            start = bisect_right(rows, tuple(page.after), key=rank_key)
+        except TypeError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return rows[start : start + page.limit + 1]
+
+
+cache = BoardCache()
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+
+import orjson
+from fastapi.concurrency import run_in_threadpool
+
+from sqlalchemy import JSON, delete, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import app.models as models
+from app.database import AsyncSessionLocal, SessionLocal
+from app.websocket import manager
+
+CHANGE_LOG_RETENTION_SECONDS = float(
+    os.getenv("CHANGE_LOG_RETENTION_SECONDS", str(7 * 24 * 3600))
+)
+CHANGE_LOG_PRUNE_INTERVAL_SECONDS = float(
+    os.getenv("CHANGE_LOG_PRUNE_INTERVAL_SECONDS", "600")
+)
+REPLAY_BATCH_SIZE = 500
+
+# Every mutation appends an event to its workspace's change log in the same
+# transaction, numbered by workspaces.change_seq. The UPDATE that takes the
+# next number holds the workspace row lock until commit, so sequence numbers
+# commit in order and without gaps: a client that has applied everything up
+# to N has missed exactly the events with seq > N.
+#
+# Recorded events wait in Session.info until the route calls publish() after
+# the commit; the broadcast message is the logged event itself, and the same
+# event keeps app.board_cache's copy of the workspace current. Each payload
+# is serialized once, and routes whose response is that payload return the
+# same bytes.
+_SESSION_KEY = "pending_changes"
+
+# Events that carry an entity's full latest state, so a later one makes an
+# earlier unsent one redundant (see ConnectionManager.broadcast).
+_COALESCE_PREFIXES = {"card_updated": "card"}
+
+logger = logging.getLogger(__name__)
+_prune_task: asyncio.Task = None
+
+
+def _frame(event_type: str, seq: int, body: bytes) -> str:
+    return (
+        f'{{"type":{orjson.dumps(event_type).decode()},"seq":{seq},'
+        f'"payload":{body.decode()}}}'
+    )
+
+
+def message(event_type: str, seq: int, payload: dict) -> str:
+    return _frame(event_type, seq, orjson.dumps(payload))
+
+
+def board_workspace(board_id: int):
+    return select(models.Board.workspace_id).where(models.Board.id == board_id)
+
+
+def list_workspace(list_id: int):
+    return (
+        select(models.Board.workspace_id)
+        .join(models.List, models.List.board_id == models.Board.id)
+        .where(models.List.id == list_id)
+    )
+
+
+def _record_query(workspace, event_type: str, payload: dict):
+    if not isinstance(workspace, int):
+        workspace = workspace.scalar_subquery()
+    bumped = (
+        update(models.Workspace)
+        .where(models.Workspace.id == workspace)
+        .values(change_seq=models.Workspace.change_seq + 1)
+        .returning(models.Workspace.id, models.Workspace.change_seq)
+        .cte("bumped")
+    )
+    return insert(models.WorkspaceChange).from_select(
+        ["workspace_id", "seq", "type", "payload"],
+        select(
+            bumped.c.id,
+            bumped.c.change_seq,
+            literal(event_type),
+            literal(payload, JSON),
+        ),
+    ).returning(models.WorkspaceChange.workspace_id, models.WorkspaceChange.seq)
+
+
+def _pending(db, row, event_type: str, payload: dict):
+    if row is None:
+        return
+    prefix = _COALESCE_PREFIXES.get(event_type)
+    coalesce_key = f"{prefix}:{payload['id']}" if prefix else None
+    body = orjson.dumps(payload)
+    db.info.setdefault(_SESSION_KEY, []).append(
+        (row.workspace_id, row.seq, event_type, payload, coalesce_key, body)
+    )
+
+
+def record(db: Session, workspace, event_type: str, payload: dict):
+    """Log an event; ``workspace`` is an id or a board_workspace/list_workspace
+    query. The caller commits."""
+    row = db.execute(_record_query(workspace, event_type, payload)).first()
+    _pending(db, row, event_type, payload)
+
+
+async def lock_workspaces_async(db: AsyncSession, *workspace_ids: int):
+    """Take the row locks of several workspaces in ascending id order, so a
+    transaction recording events in more than one cannot deadlock with another
+    recording in the same ones in the opposite order."""
+    await db.execute(
+        select(models.Workspace.id)
+        .where(models.Workspace.id.in_(workspace_ids))
+        .order_by(models.Workspace.id)
+        .with_for_update()
+    )
+
+
+async def record_async(db: AsyncSession, workspace, event_type: str, payload: dict):
+    row = (await db.execute(_record_query(workspace, event_type, payload))).first()
+    _pending(db, row, event_type, payload)
+
+
+async def publish(db) -> Optional[bytes]:
+    """Broadcast the events this session has committed, in order.
+
+    Returns the serialized payload of the last one (None if nothing was
+    recorded), for routes that respond with it.
+    """
+    # Imported here: app.board_cache imports app.crud, which imports this.
+    from app.board_cache import cache
+
+    body = None
+    for workspace_id, seq, event_type, payload, coalesce_key, body in db.info.pop(
+        _SESSION_KEY, []
+    ):
+        cache.apply(workspace_id, seq, event_type, payload)
+        await manager.broadcast(
+            workspace_id, _frame(event_type, seq, body), coalesce_key
+        )
+    return body
+
+
+async def run_and_publish(fn, *args):
+    """Run a sync app.crud function in a session of its own off the event
+    loop, then publish what it recorded. For background tasks."""
+    with SessionLocal() as db:
+        await run_in_threadpool(fn, db, *args)
+        await publish(db)
+
+
+def _since_query(workspace_id: int, since: int, limit: int):
+    return (
+        select(models.WorkspaceChange)
+        .where(
+            models.WorkspaceChange.workspace_id == workspace_id,
+            models.WorkspaceChange.seq > since,
+        )
+        .order_by(models.WorkspaceChange.seq)
+        .limit(limit + 1)
+    )
+
+
+async def changes_since(db: AsyncSession, workspace_id: int, since: int, limit: int):
+    """Feed of up to ``limit`` events after ``since``, as a ChangeFeed dict.
+
+    resync_required is set when the retention window has already pruned
+    some of the events the client is missing.
+    """
+    latest = await db.scalar(
+        select(models.Workspace.change_seq).where(models.Workspace.id == workspace_id)
+    )
+    rows = (await db.scalars(_since_query(workspace_id, since, limit))).all()
+    missing = latest is not None and latest > since
+    pruned = missing and (not rows or rows[0].seq != since + 1)
+    return {
+        "workspace_id": workspace_id,
+        "seq": latest or 0,
+        "changes": [] if pruned else rows[:limit],
+        "has_more": not pruned and len(rows) > limit,
+        "resync_required": pruned or since > (latest or 0),
+    }
+
+
+async def replay(workspace_id: int, since: int) -> AsyncIterator[str]:
+    """Messages for a reconnecting socket: every event after ``since``, or a
+    single resync_required message if some of them have been pruned."""
+    while True:
+        # A session per batch: no pooled connection is held while a slow
+        # client reads the previous one.
+        async with AsyncSessionLocal() as db:
+            feed = await changes_since(db, workspace_id, since, REPLAY_BATCH_SIZE)
+        if feed["resync_required"]:
+            yield message(
+                "resync_required",
+                feed["seq"],
+                {"workspace_id": workspace_id, "since": since},
+            )
+            return
+        for change in feed["changes"]:
+            yield message(change.type, change.seq, change.payload)
+            since = change.seq
+        if not feed["has_more"]:
+            return
+
+
+def _prune_query(retention_seconds: float):
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=retention_seconds)
+    return delete(models.WorkspaceChange).where(
+        models.WorkspaceChange.created_at < cutoff
+    )
+
+
+async def prune(
+    db: AsyncSession, retention_seconds: float = CHANGE_LOG_RETENTION_SECONDS
+):
+    result = await db.execute(_prune_query(retention_seconds))
+    await db.commit()
+    return result.rowcount
+
+
+async def _prune_forever():
+    # Every worker runs this; concurrent deletes of the same rows are harmless.
+    while True:
+        await asyncio.sleep(CHANGE_LOG_PRUNE_INTERVAL_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                pruned = await prune(db)
+            if pruned:
+                logger.info(f"Pruned {pruned} workspace changes")
+        except Exception:
+            logger.exception("Pruning the workspace change log failed")
+
+
+def start_pruning():
+    global _prune_task
+    if _prune_task is None:
+        _prune_task = asyncio.get_running_loop().create_task(_prune_forever())
+
+
+def stop_pruning():
+    global _prune_task
+    if _prune_task is not None:
+        _prune_task.cancel()
+        _prune_task = None
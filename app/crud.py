@@ -1,9 +1,54 @@
-from sqlalchemy import and_, func, or_
-from sqlalchemy.orm import Session
+from typing import Optional
 
+from sqlalchemy import Float, cast, func, select, update
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.orm import Session, selectinload
+
+import app.access as access
+import app.changes as changes
+import app.auth as auth
 import app.models as models
+import app.pagination as pagination
+import app.ranking as ranking
 import app.schemas as schemas
-from app.auth import get_password_hash
+import app.versions as versions
+
+# Text search configuration of models.Card.search_vector; queries must parse
+# with the same one for their lexemes to match.
+SEARCH_CONFIG = "english"
+SEARCH_HEADLINE_OPTIONS = (
+    "MaxFragments=2, MaxWords=20, MinWords=8, "
+    "StartSel=<mark>, StopSel=</mark>, FragmentDelimiter=' ... '"
+)
+# Escaped before ts_headline, so <mark> is the only markup in a snippet. "&"
+# goes first, or the entities of the others would be escaped again.
+HTML_ESCAPES = (
+    ("&", "&amp;"),
+    ("<", "&lt;"),
+    (">", "&gt;"),
+    ('"', "&quot;"),
+    ("'", "&#x27;"),
+)
+
+# Columns of the response schemas. Collection reads load these as plain rows
+# rather than hydrating ORM objects into the identity map.
+BOARD_COLUMNS = (models.Board.id, models.Board.name, models.Board.workspace_id)
+LIST_COLUMNS = (
+    models.List.id,
+    models.List.name,
+    models.List.position,
+    models.List.rank,
+    models.List.board_id,
+)
+CARD_COLUMNS = (
+    models.Card.id,
+    models.Card.name,
+    models.Card.description,
+    models.Card.position,
+    models.Card.rank,
+    models.Card.list_id,
+    models.Card.version,
+)
 
 
 def get_user_by_email(db: Session, email: str):
@@ -15,7 +60,7 @@ def get_user_by_email(db: Session, email: str):
 
 
 def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = get_password_hash(user.password)
+    hashed_password = auth.get_password_hash(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email.lower(),
@@ -27,47 +72,26 @@ def create_user(db: Session, user: schemas.UserCreate):
     return db_user
 
 
-def create_workspace(db: Session, workspace: schemas.WorkspaceCreate, user_id: int):
-    db_workspace = models.Workspace(**workspace.dict(), owner_id=user_id)
-    db.add(db_workspace)
-    db.commit()
-    db.refresh(db_workspace)
-    return db_workspace
-
-
-def get_workspaces(db: Session, user_id: int):
-    return (
+def get_workspaces(
+    db: Session, user_id: int, page: Optional[pagination.Page] = None
+):
+    workspace_ids = access.accessible_workspace_ids(db, user_id)
+    # The response lists each workspace's members: one IN query for the page
+    # instead of a lazy load per workspace.
+    query = (
         db.query(models.Workspace)
-        .filter(
-            or_(
-                models.Workspace.owner_id == user_id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == user_id
-                    )
-                ),
-            )
-        )
-        .all()
+        .options(selectinload(models.Workspace.members))
+        .filter(models.Workspace.id.in_(workspace_ids))
     )
+    if page:
+        query = page.apply(query, [models.Workspace.id])
+    return query.all()
 
 
 def get_workspace_by_id(db: Session, workspace_id: int, user_id: int):
-    workspace = (
-        db.query(models.Workspace)
-        .filter(
-            models.Workspace.id == workspace_id,
-            or_(
-                models.Workspace.owner_id == user_id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == user_id
-                    )
-                ),
-            ),
-        )
-        .first()
-    )
+    if not access.can_access_workspace(db, user_id, workspace_id):
+        return None
+    workspace = db.get(models.Workspace, workspace_id)
     if workspace:
         workspace.members = (
             db.query(models.User)
@@ -78,252 +102,193 @@ def get_workspace_by_id(db: Session, workspace_id: int, user_id: int):
     return workspace
 
 
-def delete_workspace(db: Session, workspace_id: int, user_id: int) -> bool:
-    workspace = (
-        db.query(models.Workspace)
-        .filter(
-            models.Workspace.id == workspace_id, models.Workspace.owner_id == user_id
-        )
-        .first()
-    )
-    if not workspace:
-        return False
-    num_deleted = (
-        db.query(models.Workspace).filter(models.Workspace.id == workspace_id).delete()
-    )
-    db.commit()
-    return num_deleted > 0
-
-
-def add_member_to_workspace(db: Session, workspace_id: int, user_id: int):
-    if (
-        not db.query(models.workspace_members)
-        .filter(
-            models.workspace_members.c.workspace_id == workspace_id,
-            models.workspace_members.c.user_id == user_id,
-        )
-        .first()
-    ):
-        ins = models.workspace_members.insert().values(
-            workspace_id=workspace_id, user_id=user_id
-        )
-        db.execute(ins)
-        db.commit()
-    return True
-
-
-def get_members(db: Session, workspace_id: int):
-    return (
+def get_members(
+    db: Session, workspace_id: int, page: Optional[pagination.Page] = None
+):
+    query = (
         db.query(models.User)
         .join(models.workspace_members)
         .filter(models.workspace_members.c.workspace_id == workspace_id)
-        .all()
     )
+    if page:
+        # Keyed on the membership row's user_id so the primary key index
+        # (workspace_id, user_id) serves the range scan.
+        query = page.apply(query, [models.workspace_members.c.user_id])
+    return query.all()
 
 
-def search_users(db: Session, query: str, exclude_user_id: int = None):
+def search_users(
+    db: Session,
+    query: str,
+    exclude_user_id: int = None,
+    page: Optional[pagination.Page] = None,
+):
     q = db.query(models.User).filter(
         func.lower(models.User.email).like(f"%{query.lower()}%")
     )
     if exclude_user_id:
         q = q.filter(models.User.id != exclude_user_id)
+    if page:
+        q = page.apply(q, [models.User.id])
     return q.all()
 
 
-def create_board(db: Session, board: schemas.BoardCreate, workspace_id: int):
-    db_board = models.Board(**board.dict(), workspace_id=workspace_id)
-    db.add(db_board)
-    db.commit()
-    db.refresh(db_board)
-    return db_board
+def search_cards(
+    db: Session,
+    workspace_id: int,
+    text: str,
+    page: Optional[pagination.Page] = None,
+):
+    """Cards in the workspace matching ``text``, best match first.
+
+    ``text`` takes web search syntax: quoted phrases, ``or`` and ``-word``.
+    Names weigh more than descriptions. Rows carry ``score`` for the keyset
+    (pages are keyed on (-score, id)) and a ``snippet`` with the matches
+    wrapped in <mark>; the card text in it is HTML-escaped.
+    """
+    config = cast(SEARCH_CONFIG, REGCONFIG)
+    tsquery = func.websearch_to_tsquery(config, text)
+    # Normalization 1 divides by the log of the card's length, so long
+    # descriptions don't outrank a matching name. Double precision, so the
+    # score in a cursor compares equal to itself.
+    score = cast(func.ts_rank_cd(models.Card.search_vector, tsquery, 1), Float)
+    query = (
+        db.query(
+            models.Card.id,
+            models.Card.name,
+            models.Card.description,
+            models.Card.list_id,
+            models.List.board_id,
+            score.label("score"),
+        )
+        .join(models.List, models.Card.list_id == models.List.id)
+        .join(models.Board, models.List.board_id == models.Board.id)
+        .filter(
+            models.Board.workspace_id == workspace_id,
+            models.Card.search_vector.op("@@")(tsquery),
+        )
+    )
+    if page:
+        query = page.apply(query, [-score, models.Card.id])
+    else:
+        query = query.order_by(-score, models.Card.id)
+    # ts_headline re-parses the text, so it runs on the page's rows only.
+    matches = query.subquery()
+    snippet_text = func.concat_ws("\n", matches.c.name, matches.c.description)
+    for character, entity in HTML_ESCAPES:
+        snippet_text = func.replace(snippet_text, character, entity)
+    return (
+        db.query(
+            matches.c.id,
+            matches.c.name,
+            matches.c.list_id,
+            matches.c.board_id,
+            matches.c.score,
+            func.ts_headline(
+                config,
+                snippet_text,
+                tsquery,
+                SEARCH_HEADLINE_OPTIONS,
+            ).label("snippet"),
+        )
+        .order_by(-matches.c.score, matches.c.id)
+        .all()
+    )
 
 
 def get_boards(db: Session, workspace_id: int):
     return (
-        db.query(models.Board).filter(models.Board.workspace_id == workspace_id).all()
+        db.query(*BOARD_COLUMNS).filter(models.Board.workspace_id == workspace_id).all()
     )
 
 
 def get_board(db: Session, board_id: int, user_id: int):
+    board = db.get(models.Board, board_id)
+    if not board or not access.can_access_workspace(db, user_id, board.workspace_id):
+        return None
+    return board
+
+
+def get_board_full(db: Session, board_id: int, user_id: int):
+    if access.board_workspace_id(db, board_id, user_id) is None:
+        return None
     return (
         db.query(models.Board)
-        .join(models.Workspace)
-        .filter(
-            models.Board.id == board_id,
-            or_(
-                models.Workspace.owner_id == user_id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == user_id
-                    )
-                ),
-            ),
-        )
+        .options(selectinload(models.Board.lists).selectinload(models.List.cards))
+        .filter(models.Board.id == board_id)
         .first()
     )
 
 
-def create_list(db: Session, list_item: schemas.ListCreate, board_id: int):
-    db_list = models.List(**list_item.dict(), board_id=board_id)
-    db.add(db_list)
-    db.commit()
-    db.refresh(db_list)
-    return db_list
-
-
-def get_lists(db: Session, board_id: int):
+def iter_board_cards(db: Session, board_id: int, batch_size: int = 1000):
+    # Rows arrive in board display order (list rank, then card rank) so
+    # callers can group them into lists without holding the whole board.
     return (
-        db.query(models.List)
+        db.query(*CARD_COLUMNS)
+        .join(models.List)
         .filter(models.List.board_id == board_id)
-        .order_by(models.List.position)
-        .all()
+        .order_by(models.List.rank, models.List.id, models.Card.rank, models.Card.id)
+        .yield_per(batch_size)
     )
 
 
-def delete_list(db: Session, list_id: int, user_id: int, board_id: int) -> bool:
-    list_item = (
-        db.query(models.List)
-        .join(models.Board)
-        .join(models.Workspace)
-        .filter(
-            models.List.id == list_id,
-            models.Board.id == board_id,
-            or_(
-                models.Workspace.owner_id == user_id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == user_id
-                    )
-                ),
-            ),
-        )
-        .first()
-    )
-    if not list_item:
-        return False
-    num_deleted = db.query(models.List).filter(models.List.id == list_id).delete()
-    db.commit()
-    return num_deleted > 0
+def get_lists(db: Session, board_id: int, page: Optional[pagination.Page] = None):
+    query = db.query(*LIST_COLUMNS).filter(models.List.board_id == board_id)
+    if page:
+        return page.apply(query, [models.List.rank, models.List.id]).all()
+    return query.order_by(models.List.rank, models.List.id).all()
 
 
-def create_card(db: Session, card: schemas.CardCreate, list_id: int):
-    db_card = models.Card(**card.dict(), list_id=list_id)
-    db.add(db_card)
-    db.commit()
-    db.refresh(db_card)
-    return db_card
+def get_cards(db: Session, list_id: int, page: Optional[pagination.Page] = None):
+    query = db.query(*CARD_COLUMNS).filter(models.Card.list_id == list_id)
+    if page:
+        return page.apply(query, [models.Card.rank, models.Card.id]).all()
+    return query.order_by(models.Card.rank, models.Card.id).all()
 
 
-def get_cards(db: Session, list_id: int):
-    return (
-        db.query(models.Card)
-        .filter(models.Card.list_id == list_id)
-        .order_by(models.Card.position)
-        .all()
+def _rebalance_ranks(db: Session, model, where) -> list:
+    ids = db.scalars(
+        select(model.id).where(where).order_by(model.rank, model.id).with_for_update()
+    ).all()
+    if not ids:
+        return []
+    ranks = ranking.initial_ranks(len(ids))
+    db.execute(
+        update(model),
+        [{"id": item_id, "rank": rank} for item_id, rank in zip(ids, ranks)],
     )
+    return [row.to_dict() for row in db.scalars(select(model).where(where))]
 
 
-def update_card(
-    db: Session,
-    card_id: int,
-    list_id: int,
-    card_update: schemas.CardUpdate,
-    user_id: int,
-):
-    card = (
-        db.query(models.Card)
-        .filter(models.Card.id == card_id, models.Card.list_id == list_id)
-        .first()
-    )
-    if not card:
-        return None
+# Rebalancing changes every rank but no order, which clients see as a
+# board_reordered event that moves nothing. Run these through
+# changes.run_and_publish.
 
-    current_list = db.query(models.List).filter(models.List.id == list_id).first()
-    if not current_list:
-        return None
-    current_board = (
-        db.query(models.Board).filter(models.Board.id == current_list.board_id).first()
-    )
-    if not current_board:
-        return None
-    current_workspace = (
-        db.query(models.Workspace)
-        .filter(models.Workspace.id == current_board.workspace_id)
-        .first()
-    )
-    if not current_workspace or not (
-        current_workspace.owner_id == user_id
-        or db.query(models.workspace_members)
-        .filter(
-            models.workspace_members.c.workspace_id == current_workspace.id,
-            models.workspace_members.c.user_id == user_id,
-        )
-        .first()
-    ):
-        return None
 
-    if card_update.list_id and card_update.list_id != list_id:
-        new_list = (
-            db.query(models.List).filter(models.List.id == card_update.list_id).first()
+def rebalance_list_ranks(db: Session, board_id: int):
+    lists = _rebalance_ranks(db, models.List, models.List.board_id == board_id)
+    versions.bump_board(db, board_id)
+    if lists:
+        changes.record(
+            db,
+            changes.board_workspace(board_id),
+            "board_reordered",
+            {"board_id": board_id, "lists": lists, "cards": []},
         )
-        if not new_list:
-            return None
-        new_board = (
-            db.query(models.Board).filter(models.Board.id == new_list.board_id).first()
-        )
-        if not new_board:
-            return None
-        new_workspace = (
-            db.query(models.Workspace)
-            .filter(models.Workspace.id == new_board.workspace_id)
-            .first()
-        )
-        if not new_workspace or not (
-            new_workspace.owner_id == user_id
-            or db.query(models.workspace_members)
-            .filter(
-                models.workspace_members.c.workspace_id == new_workspace.id,
-                models.workspace_members.c.user_id == user_id,
-            )
-            .first()
-        ):
-            return None
-        card.list_id = card_update.list_id
-
-    if card_update.position is not None:
-        card.position = card_update.position
-    if card_update.name is not None:
-        card.name = card_update.name
-    if card_update.description is not None:
-        card.description = card_update.description
-
     db.commit()
-    db.refresh(card)
-    return card
 
 
-def delete_card(db: Session, card_id: int, user_id: int, list_id: int) -> bool:
-    card = (
-        db.query(models.Card)
-        .join(models.List)
-        .join(models.Board)
-        .join(models.Workspace)
-        .filter(
-            models.Card.id == card_id,
-            models.Card.list_id == list_id,
-            or_(
-                models.Workspace.owner_id == user_id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == user_id
-                    )
-                ),
-            ),
+def rebalance_card_ranks(db: Session, list_id: int):
+    cards = _rebalance_ranks(db, models.Card, models.Card.list_id == list_id)
+    versions.bump_list_boards(db, list_id)
+    if cards:
+        board_id = db.scalar(
+            select(models.List.board_id).where(models.List.id == list_id)
+        )
+        changes.record(
+            db,
+            changes.list_workspace(list_id),
+            "board_reordered",
+            {"board_id": board_id, "lists": [], "cards": cards},
         )
-        .first()
-    )
-    if not card:
-        return False
-    num_deleted = db.query(models.Card).filter(models.Card.id == card_id).delete()
     db.commit()
-    return num_deleted > 0
@@ -1,16 +1,97 @@
 import os
+import uuid
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from app.pool_stats import TimedAsyncAdaptedQueuePool, TimedQueuePool
+
 SQLALCHEMY_DATABASE_URL = os.getenv('SUPABASE_URL')
 if not SQLALCHEMY_DATABASE_URL:
     raise ValueError("SUPABASE_URL environment variable is required. Set it to your Supabase PostgreSQL connection string (e.g., postgresql://[user]:[password]@[host]:[port]/[dbname]?sslmode=require)")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds before a pooled connection is replaced; -1 keeps it forever.
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Set when SUPABASE_URL points at pgbouncer (or Supavisor) in transaction
+# pooling mode, where consecutive transactions may run on different server
+# connections and server-side prepared statements cannot be relied on.
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+
+def pool_options(logging_name):
+    return dict(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_logging_name=logging_name,
+    )
+
+
+# psycopg2 never prepares statements server-side, so the sync engine needs
+# nothing extra behind pgbouncer.
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, poolclass=TimedQueuePool, **pool_options("sync")
+)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def async_database_url(url):
+    # asyncpg takes ssl=<mode> instead of libpq's sslmode=<mode>.
+    url = make_url(url).set(drivername="postgresql+asyncpg")
+    if "sslmode" in url.query:
+        url = url.update_query_dict({"ssl": url.query["sslmode"]}).difference_update_query(["sslmode"])
+    return url
+
+
+def async_connect_args():
+    if not DB_PGBOUNCER:
+        return {}
+    # asyncpg prepares every statement; with both caches off each one is
+    # prepared under a unique name and used within the same transaction.
+    return {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+    }
+
+
+async_engine = create_async_engine(
+    async_database_url(SQLALCHEMY_DATABASE_URL),
+    poolclass=TimedAsyncAdaptedQueuePool,
+    connect_args=async_connect_args(),
+    **pool_options("async"),
+)
+
+# expire_on_commit=False: an expired attribute would need an implicit lazy
+# load, which AsyncSession cannot do; crud refreshes explicitly instead.
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
+# Optional streaming replica of the same database. Only safe GET routes use
+# it, through app.replica.get_read_db; everything else stays on SUPABASE_URL.
+SUPABASE_REPLICA_URL = os.getenv("SUPABASE_REPLICA_URL")
+
+replica_engine = None
+ReplicaSessionLocal = None
+if SUPABASE_REPLICA_URL:
+    replica_engine = create_engine(
+        SUPABASE_REPLICA_URL, poolclass=TimedQueuePool, **pool_options("replica")
+    )
+    ReplicaSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, bind=replica_engine, info={"replica": True}
+    )
+
 Base = declarative_base()
 
 def get_db():
@@ -19,3 +100,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
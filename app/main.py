@@ -1,23 +1,139 @@
-from fastapi import FastAPI
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Depends, FastAPI, HTTPException, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.staticfiles import StaticFiles
 
-from app import models
-from app.database import engine
+from app import (
+    board_cache,
+    changes,
+    hashing,
+    metrics,
+    models,
+    pagination,
+    pool_stats,
+    query_guard,
+    replica,
+)
+from app.auth import PRINCIPAL_TOPIC, invalidate_principal
+from app.database import async_engine, engine, replica_engine
 from app.routers import auth, boards, cards, lists, websockets, workspaces
+from app.websocket import manager
+
+# Browser origins allowed to call the API with credentials (the last_write
+# cookie of read-your-writes); the production build is served same-origin.
+CORS_ALLOW_ORIGINS = os.getenv("CORS_ALLOW_ORIGINS", "http://localhost:3000").split(",")
+# Bearer token for the pool, replica, board cache and Prometheus endpoints;
+# unset, they are not served at all.
+STATS_TOKEN = os.getenv("STATS_TOKEN")
 
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
+if replica_engine is not None:
+    metrics.instrument_engine(replica_engine)
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ALLOW_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "ETag"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+if replica_engine is not None:
+    app.add_middleware(replica.ReadYourWritesMiddleware)
+if query_guard.QUERY_GUARD:
+    query_guard.install(engine, async_engine.sync_engine)
+    if replica_engine is not None:
+        query_guard.install(replica_engine)
+    app.add_middleware(query_guard.QueryGuardMiddleware)
+
+
+@app.on_event("startup")
+async def start_change_log_pruning():
+    changes.start_pruning()
+
+
+@app.on_event("startup")
+async def start_replica_monitoring():
+    replica.start_monitoring()
+
+
+@app.on_event("startup")
+async def listen_for_principal_revocations():
+    manager.backplane.listen(PRINCIPAL_TOPIC, invalidate_principal)
+
+
+@app.on_event("shutdown")
+def shutdown_hashing_pool():
+    hashing.shutdown()
+
+
+@app.on_event("shutdown")
+def stop_change_log_pruning():
+    changes.stop_pruning()
+
+
+@app.on_event("shutdown")
+def stop_replica_monitoring():
+    replica.stop_monitoring()
+
+
+stats_bearer = HTTPBearer(auto_error=False)
+
+
+def require_stats_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(stats_bearer),
+):
+    if not STATS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if credentials is None or not hmac.compare_digest(
+        credentials.credentials.encode(), STATS_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid stats token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+@app.get("/pool-stats", dependencies=[Depends(require_stats_token)])
+def read_pool_stats():
+    pools = {
+        "sync": pool_stats.pool_status(engine),
+        "async": pool_stats.pool_status(async_engine.sync_engine),
+    }
+    if replica_engine is not None:
+        pools["replica"] = pool_stats.pool_status(replica_engine)
+    return pools
+
+
+@app.get("/replica-stats", dependencies=[Depends(require_stats_token)])
+def read_replica_stats():
+    if replica.monitor is None:
+        return {"configured": False}
+    return {"configured": True, **replica.monitor.stats()}
+
+
+@app.get("/board-cache-stats", dependencies=[Depends(require_stats_token)])
+def read_board_cache_stats():
+    return board_cache.cache.stats()
+
+
+@app.get("/metrics", dependencies=[Depends(require_stats_token)])
+def read_metrics():
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
 
 # Serve React frontend static files
 app.mount("/static", StaticFiles(directory="frontend/build/static"), name="static")
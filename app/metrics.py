@@ -0,0 +1,298 @@
+import contextvars
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram
+from prometheus_client import REGISTRY, disable_created_metrics, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.core import HistogramMetricFamily
+from sqlalchemy import event
+from starlette.routing import Match
+
+# Everything here is per process: with --workers N, scrape each worker (or
+# put the metrics port behind a sidecar that does).
+
+# The *_created series double the output and nothing reads them.
+disable_created_metrics()
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to the end of the response body, by route template.",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests being handled, by route template.",
+    ["method", "route"],
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL statements executed while handling one request.",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds",
+    "Time spent executing SQL while handling one request.",
+    ["method", "route"],
+)
+DB_QUERIES = Counter(
+    "db_queries_total", "SQL statements executed, in or out of a request."
+)
+BROADCAST_FAN_OUT = Histogram(
+    "ws_broadcast_fan_out_seconds",
+    "Time to encode a broadcast and queue it for every socket on the workspace.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+
+class _RequestQueries:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# The current request's counters. Sync routes run in a thread pool that
+# copies the context, and AsyncSession's greenlets share it, so statements
+# from either engine land on the request that issued them.
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started_at"].pop()
+    DB_QUERIES.inc()
+    queries = _request_queries.get()
+    if queries is not None:
+        queries.count += 1
+        queries.seconds += elapsed
+
+
+def instrument_engine(engine):
+    """Count statements run on a sync Engine or an AsyncEngine's sync_engine."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _route_template(app, scope) -> str:
+    # Matched against the app's routes up front so the in-progress gauge can
+    # carry the route too; the path itself would be a label per card id.
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, in-flight requests and SQL per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = _route_template(scope["app"], scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        queries = _RequestQueries()
+        token = _request_queries.set(queries)
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_LATENCY.labels(method, route, str(status)).observe(
+                time.perf_counter() - started
+            )
+            in_progress.dec()
+            _request_queries.reset(token)
+            REQUEST_QUERIES.labels(method, route).observe(queries.count)
+            REQUEST_DB_TIME.labels(method, route).observe(queries.seconds)
+
+
+def _counter(name, documentation, value):
+    metric = CounterMetricFamily(name, documentation)
+    metric.add_metric([], value)
+    return metric
+
+
+def _gauge(name, documentation, value):
+    metric = GaugeMetricFamily(name, documentation)
+    metric.add_metric([], value)
+    return metric
+
+
+def _websocket_metrics():
+    from app.websocket import manager
+
+    stats = manager.stats()
+    connections = GaugeMetricFamily(
+        "ws_connections", "Open WebSocket connections.", labels=["workspace_id"]
+    )
+    for workspace_id, count in stats["connections_per_workspace"].items():
+        connections.add_metric([str(workspace_id)], count)
+    yield connections
+    yield _gauge(
+        "ws_send_queue_depth",
+        "Frames queued on all sockets.",
+        stats["queue_depth_total"],
+    )
+    for name, documentation in (
+        ("messages_sent", "Frames written to sockets."),
+        ("bytes_sent", "Bytes written to sockets."),
+        ("messages_dropped", "Frames dropped for slow sockets."),
+        ("messages_coalesced", "Broadcasts superseded within the coalesce window."),
+        ("relays_rejected", "Client frames not relayed for not being JSON objects."),
+        ("send_failures", "Socket writes that raised or timed out."),
+        ("encode_failures", "Messages a wire format could not encode."),
+        ("connections_evicted", "Sockets closed for falling behind."),
+    ):
+        yield _counter(f"ws_{name}", documentation, stats[name])
+
+
+def _pool_metrics():
+    from app import pool_stats
+    from app.database import async_engine, engine, replica_engine
+
+    connections = GaugeMetricFamily(
+        "db_pool_connections", "Pooled connections by state.", labels=["pool", "state"]
+    )
+    waits = HistogramMetricFamily(
+        "db_pool_checkout_wait_seconds",
+        "Time spent waiting for a pooled connection.",
+        labels=["pool"],
+    )
+    timeouts = CounterMetricFamily(
+        "db_pool_checkout_timeouts", "Checkouts that gave up waiting.", labels=["pool"]
+    )
+    pools = [("sync", engine), ("async", async_engine.sync_engine)]
+    if replica_engine is not None:
+        pools.append(("replica", replica_engine))
+    for name, pool_engine in pools:
+        status = pool_stats.pool_status(pool_engine)
+        for state in ("size", "checked_out", "checked_in", "overflow"):
+            connections.add_metric([name, state], status[state])
+        waits.add_metric(
+            [name],
+            list(status["wait_seconds_buckets"].items()),
+            status["wait_seconds_sum"],
+        )
+        timeouts.add_metric([name], status["timeouts"])
+    yield from (connections, waits, timeouts)
+
+
+def _replica_metrics():
+    from app.replica import monitor
+
+    if monitor is None:
+        return
+    stats = monitor.stats()
+    yield _gauge(
+        "db_replica_healthy",
+        "1 while the read replica is reachable and within REPLICA_MAX_LAG_SECONDS.",
+        int(stats["healthy"]),
+    )
+    yield _gauge(
+        "db_replica_lag_seconds",
+        "Time since the newest primary WAL position the replica has replayed.",
+        stats["lag_seconds"],
+    )
+    if stats["lag_bytes"] is not None:
+        yield _gauge(
+            "db_replica_lag_bytes",
+            "WAL bytes the replica had yet to replay at the last check.",
+            stats["lag_bytes"],
+        )
+    yield _counter(
+        "db_replica_check_failures",
+        "Replication checks that could not reach either server.",
+        stats["check_failures"],
+    )
+    reads = CounterMetricFamily(
+        "db_reads",
+        "Read-only route sessions by the server chosen and why.",
+        labels=["target", "reason"],
+    )
+    for read in stats["reads"]:
+        reads.add_metric([read["target"], read["reason"]], read["count"])
+    yield reads
+
+
+def _cache_metrics():
+    from app import access, auth, board_cache, hashing
+
+    entries = GaugeMetricFamily(
+        "cache_entries", "Entries held by in-process caches.", labels=["cache"]
+    )
+    lookups = CounterMetricFamily(
+        "cache_lookups", "Cache lookups by result.", labels=["cache", "result"]
+    )
+    for name, stats in (
+        ("workspace_access", access.cache_stats()),
+        ("principal", auth.principal_cache_stats()),
+    ):
+        entries.add_metric([name], stats["size"])
+        lookups.add_metric([name, "hit"], stats["hits"])
+        lookups.add_metric([name, "miss"], stats["misses"])
+    board_stats = board_cache.cache.stats()
+    entries.add_metric(["board"], board_stats["workspaces"])
+    lookups.add_metric(["board", "hit"], board_stats["hits"])
+    lookups.add_metric(["board", "miss"], board_stats["misses"])
+    yield from (entries, lookups)
+    yield _gauge(
+        "board_cache_bytes",
+        "Estimated memory held by cached workspace rows.",
+        board_stats["bytes"],
+    )
+    yield _counter(
+        "board_cache_evictions",
+        "Workspaces evicted to stay under BOARD_CACHE_MAX_BYTES.",
+        board_stats["evictions"],
+    )
+    yield _gauge(
+        "password_hashes_pending",
+        "Hash jobs queued or running in the process pool.",
+        hashing.stats()["pending"],
+    )
+
+
+class _StatsCollector:
+    # Read at scrape time from the stats() the modules already keep, so none
+    # of these add work to the request or broadcast path.
+
+    def describe(self):
+        # Without this the registry calls collect() on registration, which
+        # would import app.database from here.
+        return []
+
+    def collect(self):
+        yield from _websocket_metrics()
+        yield from _pool_metrics()
+        yield from _replica_metrics()
+        yield from _cache_metrics()
+
+
+REGISTRY.register(_StatsCollector())
+
+
+def render():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,9 +1,42 @@
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Table
-from sqlalchemy.orm import relationship
+from operator import attrgetter
+
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    Boolean,
+    Column,
+    Computed,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Table,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 
 from .database import Base
 
+_column_getters = {}
+
+
+def _to_dict(row) -> dict:
+    # Column names and a single attrgetter per model, built on first use
+    # rather than walking __table__.columns on every call.
+    model = type(row)
+    getter = _column_getters.get(model)
+    if getter is None:
+        names = tuple(
+            column.name
+            for column in model.__table__.columns
+            if column.computed is None
+        )
+        getter = _column_getters[model] = (names, attrgetter(*names))
+    names, get = getter
+    return dict(zip(names, get(row)))
+
 
 class User(Base):
     __tablename__ = "users"
@@ -21,6 +54,10 @@ class User(Base):
     )
 
 
+# get_user_by_email compares lower(email), which ix_users_email cannot serve.
+Index("ix_users_email_lower", func.lower(User.email))
+
+
 workspace_members = Table(
     "workspace_members",
     Base.metadata,
@@ -33,6 +70,9 @@ workspace_members = Table(
     Column(
         "user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
     ),
+    # The primary key leads with workspace_id; "which workspaces can this user
+    # see" needs its own index.
+    Index("ix_workspace_members_user_id", "user_id"),
 )
 
 
@@ -41,7 +81,12 @@ class Workspace(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    # Incremented by every mutation of the workspace row, its members or its
+    # set of boards; see app.versions.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Sequence number of the latest WorkspaceChange; see app.changes.
+    change_seq = Column(Integer, nullable=False, default=0, server_default="0")
 
     owner = relationship("User", back_populates="workspaces")
     boards = relationship(
@@ -52,7 +97,7 @@ class Workspace(Base):
     )
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return _to_dict(self)
 
 
 class Board(Base):
@@ -60,13 +105,22 @@ class Board(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    workspace_id = Column(Integer, ForeignKey("workspaces.id"))
+    workspace_id = Column(
+        Integer, ForeignKey("workspaces.id", ondelete="CASCADE"), index=True
+    )
+    # Incremented by every mutation of the board, its lists or their cards.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     workspace = relationship("Workspace", back_populates="boards")
-    lists = relationship("List", back_populates="board", cascade="all, delete-orphan")
+    lists = relationship(
+        "List",
+        back_populates="board",
+        cascade="all, delete-orphan",
+        order_by="[List.rank, List.id]",
+    )
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return _to_dict(self)
 
 
 class List(Base):
@@ -75,13 +129,21 @@ class List(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     position = Column(Integer)
-    board_id = Column(Integer, ForeignKey("boards.id"))
+    rank = Column(String(collation="C"))
+    board_id = Column(Integer, ForeignKey("boards.id", ondelete="CASCADE"))
 
     board = relationship("Board", back_populates="lists")
-    cards = relationship("Card", back_populates="list", cascade="all, delete-orphan")
+
+    __table_args__ = (Index("ix_lists_board_id_rank_id", "board_id", "rank", "id"),)
+    cards = relationship(
+        "Card",
+        back_populates="list",
+        cascade="all, delete-orphan",
+        order_by="[Card.rank, Card.id]",
+    )
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return _to_dict(self)
 
 
 class Card(Base):
@@ -91,9 +153,52 @@ class Card(Base):
     name = Column(String, index=True)
     description = Column(String, nullable=True)
     position = Column(Integer)
-    list_id = Column(Integer, ForeignKey("lists.id"))
+    rank = Column(String(collation="C"))
+    list_id = Column(Integer, ForeignKey("lists.id", ondelete="CASCADE"))
+    # Incremented by every edit or move of the card; an update that names an
+    # older version is rejected (see async_crud.update_card).
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Maintained by Postgres from name and description for full-text search
+    # (crud.search_cards). Deferred: card reads never need it.
+    search_vector = deferred(
+        Column(
+            TSVECTOR,
+            Computed(
+                "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+                persisted=True,
+            ),
+        )
+    )
 
     list = relationship("List", back_populates="cards")
 
+    __table_args__ = (
+        Index("ix_cards_list_id_rank_id", "list_id", "rank", "id"),
+        Index("ix_cards_search_vector", "search_vector", postgresql_using="gin"),
+    )
+    # Otherwise every INSERT would return the generated search_vector.
+    __mapper_args__ = {"eager_defaults": False}
+
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return _to_dict(self)
+
+
+class WorkspaceChange(Base):
+    __tablename__ = "workspace_changes"
+
+    id = Column(BigInteger, primary_key=True)
+    workspace_id = Column(
+        Integer, ForeignKey("workspaces.id", ondelete="CASCADE"), nullable=False
+    )
+    seq = Column(Integer, nullable=False)
+    type = Column(String, nullable=False)
+    payload = Column(JSON)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index(
+            "ix_workspace_changes_workspace_id_seq", "workspace_id", "seq", unique=True
+        ),
+        Index("ix_workspace_changes_created_at", "created_at"),
+    )
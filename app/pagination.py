@@ -0,0 +1,95 @@
+import base64
+import json
+import os
+from typing import Optional, Sequence
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import tuple_
+
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "500"))
+
+# Collection routes return one page as a plain JSON array and put the cursor
+# for the next page in this header; it is absent on the last page.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _matches(value, python_type) -> bool:
+    # JSON gives bool for true/false, which isinstance would take as an int.
+    if value is None:
+        return True
+    if isinstance(value, bool):
+        return python_type is bool
+    if python_type is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, python_type)
+
+
+class Page:
+    """Keyset page request: at most ``limit`` rows sorting after ``after``."""
+
+    def __init__(self, limit: int, after: Optional[tuple] = None):
+        self.limit = limit
+        self.after = after
+
+    def check_after(self, types: Sequence[type]):
+        """Reject a cursor that does not hold one value of each of ``types``.
+
+        Cursors come from clients: a mistyped value would otherwise reach
+        the database and fail there as a 500.
+        """
+        if self.after is not None and (
+            len(self.after) != len(types)
+            or not all(map(_matches, self.after, types))
+        ):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    def apply(self, query, columns: Sequence):
+        # One extra row tells the route whether another page exists without
+        # a COUNT. ``columns`` must be unique together (end with the id).
+        if self.after is not None:
+            self.check_after([column.type.python_type for column in columns])
+            if len(columns) == 1:
+                query = query.filter(columns[0] > self.after[0])
+            else:
+                query = query.filter(tuple_(*columns) > tuple_(*self.after))
+        return query.order_by(*columns).limit(self.limit + 1)
+
+
+def encode_cursor(key: Sequence) -> str:
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, list) or not key:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(key)
+
+
+def page_params(
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+) -> Page:
+    return Page(limit, decode_cursor(cursor) if cursor else None)
+
+
+def respond(response: Response, rows: list, page: Page, key) -> list:
+    """Trim the look-ahead row and set the next-page cursor header."""
+    if len(rows) > page.limit:
+        rows = rows[: page.limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(key(rows[-1]))
+    return rows
+
+
+def rank_key(item):
+    return (item.rank, item.id)
+
+
+def id_key(item):
+    return (item.id,)
@@ -0,0 +1,92 @@
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Upper bounds, in seconds, of the checkout wait histogram; the last bucket
+# is unbounded. Anything past the first bucket means requests queued for a
+# connection, and a wait reaching DB_POOL_TIMEOUT ends in a timeout.
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_sum = 0.0
+        self.checkouts = 0
+        self.timeouts = 0
+
+    def observe_wait(self, seconds: float, timed_out: bool = False):
+        bucket = next(
+            (i for i, bound in enumerate(WAIT_BUCKETS) if seconds <= bound),
+            len(WAIT_BUCKETS),
+        )
+        with self._lock:
+            self.wait_counts[bucket] += 1
+            self.wait_sum += seconds
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self.wait_counts)
+            wait_sum, checkouts, timeouts = self.wait_sum, self.checkouts, self.timeouts
+        cumulative, buckets = 0, {}
+        for bound, count in zip(WAIT_BUCKETS + ("+Inf",), counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "checkouts": checkouts,
+            "timeouts": timeouts,
+            "wait_seconds_sum": wait_sum,
+            "wait_seconds_buckets": buckets,
+        }
+
+
+# Keyed by the engine's pool_logging_name, which survives the pool being
+# recreated by engine.dispose().
+_stats = {}
+
+
+def stats_for(name: str) -> PoolStats:
+    return _stats.setdefault(name, PoolStats())
+
+
+class _TimedCheckout:
+    # _do_get is where a checkout blocks when every connection is in use and
+    # the overflow is exhausted, so its duration is the time spent queued.
+    def _do_get(self):
+        stats = stats_for(self.logging_name)
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            stats.observe_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        stats.observe_wait(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": pool._max_overflow,
+        "timeout_seconds": pool.timeout(),
+        **stats_for(pool.logging_name).snapshot(),
+    }
@@ -0,0 +1,160 @@
+import contextvars
+import os
+import sys
+from collections import Counter, defaultdict
+from typing import Optional
+
+from greenlet import getcurrent
+from sqlalchemy import event
+
+# Development and test aid, off in production: with QUERY_GUARD=true every
+# HTTP request counts the SQL statements it runs, and the statement that
+# takes a route past the budget declared with @query_budget, or that repeats
+# one statement shape more than QUERY_GUARD_MAX_REPEATS times (the N+1
+# pattern), raises QueryBudgetExceeded. The error names the app code that
+# issued each statement, so the 500 and its traceback point at the culprit.
+QUERY_GUARD = os.getenv("QUERY_GUARD", "false").lower() == "true"
+QUERY_GUARD_MAX_REPEATS = int(os.getenv("QUERY_GUARD_MAX_REPEATS", "3"))
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_UNDECLARED = object()
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def query_budget(queries: Optional[int]):
+    """Declare the most SQL statements one request to the route may run.
+
+    Count a cold request: principal and access caches empty, and a board
+    cache copy that reads the change log to catch up and still falls back to
+    the database. None marks a route whose statement count grows with its
+    request body on purpose; it is exempt from both checks.
+    """
+
+    def decorate(endpoint):
+        endpoint.query_budget = queries
+        return endpoint
+
+    return decorate
+
+
+def _stacks(frame):
+    # AsyncSession runs statements in a child greenlet whose stack stops at
+    # the sync Session call; the awaiting app code is on its parent's.
+    yield frame
+    current = getcurrent().parent
+    while current is not None:
+        if current.gr_frame is not None:
+            yield current.gr_frame
+        current = current.parent
+
+
+def _call_site() -> str:
+    """The innermost frame in app/ (outside this module) that led here."""
+    for frame in _stacks(sys._getframe()):
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(_APP_DIR) and filename != __file__:
+                path = os.path.relpath(filename, os.path.dirname(_APP_DIR))
+                return f"{path}:{frame.f_lineno} in {frame.f_code.co_name}"
+            frame = frame.f_back
+    return "<outside app>"
+
+
+class _Tracker:
+    def __init__(self, label: str, budget=_UNDECLARED, scope=None):
+        self.label = label
+        self.budget = budget
+        self.scope = scope
+        self.statements = []
+        self.call_sites = defaultdict(list)
+        self.finished = False
+
+    def current_budget(self):
+        if self.scope is None:
+            return self.budget
+        # Set by the router once the request is matched, which is before
+        # any dependency or endpoint runs a statement.
+        return getattr(self.scope.get("endpoint"), "query_budget", _UNDECLARED)
+
+    def report(self, problem: str, statements) -> str:
+        lines = [f"{self.label}: {problem}"]
+        for statement in statements:
+            shape = " ".join(statement.split())
+            lines.append(f"  {shape[:200]}")
+            for site, count in Counter(self.call_sites[statement]).items():
+                lines.append(f"    {count}x at {site}")
+        return "\n".join(lines)
+
+    def observe(self, statement: str):
+        if self.finished:
+            return
+        self.statements.append(statement)
+        self.call_sites[statement].append(_call_site())
+        budget = self.current_budget()
+        if budget is None:
+            return
+        if budget is _UNDECLARED:
+            raise QueryBudgetExceeded(
+                self.report("route declares no @query_budget", [statement])
+            )
+        if len(self.statements) > budget:
+            raise QueryBudgetExceeded(
+                self.report(
+                    f"{len(self.statements)} statements, budget is {budget}",
+                    dict.fromkeys(self.statements),
+                )
+            )
+        if len(self.call_sites[statement]) > QUERY_GUARD_MAX_REPEATS:
+            raise QueryBudgetExceeded(
+                self.report(
+                    f"same statement run {len(self.call_sites[statement])} times",
+                    [statement],
+                )
+            )
+
+
+_tracker = contextvars.ContextVar("query_guard_tracker", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Before, not after: the statement over budget is the one that fails.
+    tracker = _tracker.get()
+    if tracker is not None:
+        tracker.observe(statement)
+
+
+def install(*engines):
+    """Watch statements on sync Engines or AsyncEngine.sync_engines."""
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+
+
+class QueryGuardMiddleware:
+    """ASGI middleware holding each HTTP request to its route's budget."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tracker = _Tracker(f"{scope['method']} {scope['path']}", scope=scope)
+
+        async def send_tracked(message):
+            await send(message)
+            # Background tasks (rank rebalancing) run after the last body
+            # chunk, still inside this call; they are not the route's cost.
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body"
+            ):
+                tracker.finished = True
+
+        token = _tracker.set(tracker)
+        try:
+            await self.app(scope, receive, send_tracked)
+        finally:
+            _tracker.reset(token)
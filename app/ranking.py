@@ -0,0 +1,124 @@
+from typing import List, Optional
+
+from sqlalchemy import func, select
+
+# Lists and cards are ordered by a base-62 string rank compared byte-wise (the
+# columns use the "C" collation). A new rank can always be made between two
+# others, so moving an item rewrites only that item's row.
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+
+# Ranks grow by about one character per few inserts into the same gap; past
+# this length the parent's ranks are rewritten evenly in the background.
+MAX_RANK_LENGTH = 32
+# Appends and prepends step the end rank by one unit in its last of
+# APPEND_WIDTH digits instead of halving the open-ended gap, so a list that
+# only grows at one end gains a character per millions of inserts, not per few.
+APPEND_WIDTH = 4
+
+
+def rank_between(before: Optional[str], after: Optional[str]) -> str:
+    """Return a rank sorting strictly after ``before`` and before ``after``.
+
+    Either bound may be None for the start/end of the sequence. Generated ranks
+    never end in "0", which keeps room in front of every rank.
+    """
+    before = before or ""
+    if after is not None and before >= after:
+        if before != after:
+            raise ValueError(f"rank {before!r} is not below {after!r}")
+        # Two items share a rank (concurrent inserts); place just after them.
+        return before + DIGITS[BASE // 2]
+    if before and after is None:
+        stepped = _step(before, 1)
+    elif not before and after is not None:
+        stepped = _step(after, -1)
+    else:
+        stepped = None
+    if stepped is not None:
+        return stepped
+    rank = ""
+    index = 0
+    while True:
+        low = DIGITS.index(before[index]) if index < len(before) else 0
+        high = (
+            DIGITS.index(after[index])
+            if after is not None and index < len(after)
+            else BASE
+        )
+        if high - low > 1:
+            return rank + DIGITS[(low + high) // 2]
+        rank += DIGITS[low]
+        if high != low:
+            # rank is now below ``after`` whatever follows.
+            after = None
+        index += 1
+
+
+def _step(rank: str, delta: int) -> Optional[str]:
+    # ``rank`` moved by ``delta`` units of its last digit, padded with "0" to
+    # a multiple of APPEND_WIDTH; None once that width is used up.
+    width = -(-len(rank) // APPEND_WIDTH) * APPEND_WIDTH
+    value = 0
+    for digit in rank.ljust(width, "0"):
+        value = value * BASE + DIGITS.index(digit)
+    value += delta
+    if not 0 < value < BASE**width:
+        return None
+    digits = []
+    for _ in range(width):
+        value, digit = divmod(value, BASE)
+        digits.append(DIGITS[digit])
+    return "".join(reversed(digits)).rstrip("0")
+
+
+def initial_ranks(count: int) -> List[str]:
+    """``count`` evenly spaced ranks, used for backfills and rebalancing."""
+    width = 1
+    while BASE**width < count + 1:
+        width += 1
+    width += 1
+    ranks = []
+    for position in range(1, count + 1):
+        value = position * BASE**width // (count + 1)
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, BASE)
+            digits.append(DIGITS[digit])
+        ranks.append("".join(reversed(digits)).rstrip("0"))
+    return ranks
+
+
+def needs_rebalance(rank: Optional[str]) -> bool:
+    return rank is not None and len(rank) > MAX_RANK_LENGTH
+
+
+def neighbours_query(rank_column, id_column, where, position: int):
+    # The ranks either side of index ``position`` among the rows matching where.
+    return (
+        select(rank_column)
+        .where(*where)
+        .order_by(rank_column, id_column)
+        .offset(max(position - 1, 0))
+        .limit(2)
+    )
+
+
+def last_rank_query(rank_column, where):
+    return select(func.max(rank_column)).where(*where)
+
+
+def rank_for_position(
+    position: Optional[int], ranks: List[str], last_rank: Optional[str] = None
+) -> str:
+    """Rank for index ``position`` from the result of neighbours_query.
+
+    ``last_rank`` is only needed when the index is past the end (ranks empty).
+    """
+    if position is not None and position <= 0:
+        return rank_between(None, ranks[0] if ranks else None)
+    if len(ranks) == 2:
+        return rank_between(ranks[0], ranks[1])
+    if len(ranks) == 1:
+        return rank_between(ranks[0], None)
+    return rank_between(last_rank, None)
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from fastapi import Request
+from sqlalchemy import text
+
+from app.database import ReplicaSessionLocal, SessionLocal, engine, replica_engine
+
+REPLICA_CHECK_INTERVAL_SECONDS = float(
+    os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", "1")
+)
+# A replica further behind than this takes no reads at all.
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+# How long after a client's write its reads may still be held on the primary.
+# Keep it above REPLICA_MAX_LAG_SECONDS: a replica within that lag is no more
+# than that far behind any write.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+
+LAST_WRITE_COOKIE = "last_write"
+_SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Replication is followed by LSN, not by clock. Every check samples the
+# primary's current WAL position and the replica's replay position. Once the
+# replica has replayed past a sample, it holds every commit made before that
+# sample was taken, so caught_up_through (the time of the newest such sample)
+# is a point in time the replica is known to be current to. Its distance from
+# now is the lag, which keeps growing when checks stop succeeding.
+#
+# A write marks its client with a cookie holding the time it committed, and
+# the client's reads stay on the primary until caught_up_through passes it.
+# The cookie makes this work whichever worker serves the read; it compares
+# wall clocks, so workers on different hosts need them in sync.
+
+logger = logging.getLogger(__name__)
+_monitor_task: asyncio.Task = None
+
+
+def parse_lsn(lsn: str) -> int:
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+class ReplicaMonitor:
+    def __init__(self):
+        self.caught_up_through = 0.0
+        self.lag_bytes = None
+        self.checks = 0
+        self.check_failures = 0
+        self.last_error = None
+        self.reads = Counter()
+        self._samples = deque(maxlen=1024)
+        self._lock = threading.Lock()
+
+    def check(self):
+        sampled_at = time.time()
+        try:
+            with engine.connect() as connection:
+                primary = parse_lsn(
+                    connection.scalar(text("SELECT pg_current_wal_lsn()::text"))
+                )
+            with replica_engine.connect() as connection:
+                replayed = connection.scalar(
+                    text("SELECT pg_last_wal_replay_lsn()::text")
+                )
+            if replayed is None:
+                raise RuntimeError("SUPABASE_REPLICA_URL is not a standby server")
+        except Exception as exc:
+            with self._lock:
+                self.checks += 1
+                self.check_failures += 1
+                if self.last_error is None:
+                    logger.warning(f"Read replica check failed: {exc}")
+                self.last_error = str(exc)
+            return
+        replayed = parse_lsn(replayed)
+        with self._lock:
+            self.checks += 1
+            if self.last_error is not None:
+                logger.info("Read replica check succeeded again")
+            self.last_error = None
+            self._samples.append((sampled_at, primary))
+            while self._samples and self._samples[0][1] <= replayed:
+                self.caught_up_through = self._samples.popleft()[0]
+            self.lag_bytes = max(0, primary - replayed)
+
+    def lag_seconds(self) -> float:
+        return max(0.0, time.time() - self.caught_up_through)
+
+    def route(self, request: Request):
+        """("replica" or "primary", reason) for a read in ``request``."""
+        if request.method not in _SAFE_METHODS:
+            return "primary", "unsafe_method"
+        if self.last_error is not None:
+            return "primary", "replica_unavailable"
+        if self.lag_seconds() > REPLICA_MAX_LAG_SECONDS:
+            return "primary", "replica_lagging"
+        try:
+            last_write = float(request.cookies.get(LAST_WRITE_COOKIE, 0))
+        except ValueError:
+            last_write = 0.0
+        if last_write > self.caught_up_through:
+            return "primary", "read_your_writes"
+        return "replica", "replica_current"
+
+    def count(self, target: str, reason: str):
+        with self._lock:
+            self.reads[target, reason] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "healthy": self.last_error is None
+                and self.lag_seconds() <= REPLICA_MAX_LAG_SECONDS,
+                "lag_seconds": round(self.lag_seconds(), 3),
+                "lag_bytes": self.lag_bytes,
+                "checks": self.checks,
+                "check_failures": self.check_failures,
+                "reads": [
+                    {"target": target, "reason": reason, "count": count}
+                    for (target, reason), count in sorted(self.reads.items())
+                ],
+            }
+
+
+monitor = ReplicaMonitor() if replica_engine is not None else None
+
+
+def get_read_db(request: Request):
+    """get_db for read-only routes: a replica session when that is safe.
+
+    Falls back to the primary when no replica is configured, when it is
+    unreachable or too far behind, and for a client whose last write the
+    replica has not replayed yet.
+    """
+    session_factory = SessionLocal
+    if monitor is not None:
+        target, reason = monitor.route(request)
+        monitor.count(target, reason)
+        if target == "replica":
+            session_factory = ReplicaSessionLocal
+    db = session_factory()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class ReadYourWritesMiddleware:
+    """ASGI middleware stamping each unsafe request's response with the time
+    it was sent, after the route committed, for get_read_db to compare."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in _SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_stamped(message):
+            if message["type"] == "http.response.start":
+                cookie = (
+                    f"{LAST_WRITE_COOKIE}={time.time():.3f}; "
+                    f"Max-Age={int(READ_YOUR_WRITES_SECONDS)}; Path=/; "
+                    "HttpOnly; SameSite=Lax"
+                )
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"set-cookie", cookie.encode())
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_stamped)
+
+
+async def _monitor_forever():
+    while True:
+        await asyncio.to_thread(monitor.check)
+        await asyncio.sleep(REPLICA_CHECK_INTERVAL_SECONDS)
+
+
+def start_monitoring():
+    global _monitor_task
+    if monitor is not None and _monitor_task is None:
+        _monitor_task = asyncio.get_running_loop().create_task(_monitor_forever())
+
+
+def stop_monitoring():
+    global _monitor_task
+    if _monitor_task is not None:
+        _monitor_task.cancel()
+        _monitor_task = None
@@ -1,33 +1,48 @@
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import crud, schemas, models
-from app.database import get_db
-from app.auth import authenticate_user, create_access_token, get_user, ACCESS_TOKEN_EXPIRE_MINUTES
+from app import async_crud, hashing, schemas, models
+from app.database import get_async_db
+from app.query_guard import query_budget
+from app.auth import authenticate_user_async, create_access_token, get_user, revoke_principal, ACCESS_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter()
 
 @router.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+@query_budget(3)
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await async_crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(
             status_code=400,
             detail="Email already registered"
         )
-    return crud.create_user(db=db, user=user)
+    hashed_password = await hashing.hash_password(user.password)
+    return await async_crud.create_user(db=db, user=user, hashed_password=hashed_password)
 
 
 @router.get("/me", response_model=schemas.User)
+@query_budget(1)
 def read_users_me(current_user: models.User = Depends(get_user)):
     return current_user
 
 
+@router.delete("/me")
+@query_budget(2)
+async def deactivate_users_me(current_user: models.User = Depends(get_user), db: AsyncSession = Depends(get_async_db)):
+    email = await async_crud.set_user_active(db, current_user.id, False)
+    # The token itself stays valid; get_user rejects it once no worker has
+    # the principal cached.
+    await revoke_principal(email)
+    return {"message": "Account deactivated"}
+
+
 @router.post("/token", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+@query_budget(2)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,78 +1,96 @@
-import json
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import or_
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app import crud, models, schemas
+from app import (
+    access,
+    async_crud,
+    board_cache,
+    changes,
+    crud,
+    schemas,
+    serialization,
+    versions,
+)
 from app.auth import get_user
-from app.database import get_db
-from app.websocket import manager
+from app.database import get_async_db
+from app.query_guard import query_budget
+from app.replica import get_read_db
 
 router = APIRouter(prefix="/workspaces", tags=["boards"])
 
 
 @router.post("/{workspace_id}/boards/", response_model=schemas.Board)
+@query_budget(6)
 async def create_board_for_workspace(
     workspace_id: int,
     board: schemas.BoardCreate,
     current_user=Depends(get_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    workspace = (
-        db.query(models.Workspace)
-        .filter(
-            models.Workspace.id == workspace_id,
-            or_(
-                models.Workspace.owner_id == current_user.id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == current_user.id
-                    )
-                ),
-            ),
-        )
-        .first()
-    )
-    if not workspace:
+    if not await access.can_access_workspace_async(db, current_user.id, workspace_id):
         raise HTTPException(status_code=404, detail="Workspace not found")
-    new_board = crud.create_board(db=db, board=board, workspace_id=workspace_id)
-    await manager.broadcast(
-        workspace_id,
-        json.dumps({"type": "board_created", "payload": new_board.to_dict()}),
+    new_board = await async_crud.create_board(
+        db=db, board=board, workspace_id=workspace_id
     )
-    return new_board
+    body = await changes.publish(db)
+    return serialization.body_response(body) if body else new_board
 
 
 @router.get("/{workspace_id}/boards/", response_model=List[schemas.Board])
+@query_budget(5)
 def read_boards(
-    workspace_id: int, current_user=Depends(get_user), db: Session = Depends(get_db)
+    workspace_id: int,
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    current_user=Depends(get_user),
+    db: Session = Depends(get_read_db),
 ):
-    workspace = (
-        db.query(models.Workspace)
-        .filter(
-            models.Workspace.id == workspace_id,
-            or_(
-                models.Workspace.owner_id == current_user.id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == current_user.id
-                    )
-                ),
-            ),
-        )
-        .first()
-    )
-    if not workspace:
+    current = versions.workspace_version(db, workspace_id, current_user.id)
+    if current is None:
         raise HTTPException(status_code=404, detail="Workspace not found")
-    return crud.get_boards(db, workspace_id)
+    cached = versions.not_modified(
+        request, response, versions.etag("workspace", workspace_id, current.version)
+    )
+    if cached:
+        return cached
+    boards = board_cache.cache.boards(db, current, background_tasks)
+    if boards is not None:
+        return serialization.value_response(boards, response)
+    return serialization.rows_response(crud.get_boards(db, workspace_id), response)
 
 
 @router.get("/boards/{board_id}/", response_model=schemas.Board)
+@query_budget(5)
 def read_board(
-    board_id: int, current_user=Depends(get_user), db: Session = Depends(get_db)
+    board_id: int,
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    current_user=Depends(get_user),
+    db: Session = Depends(get_read_db),
 ):
+    current = versions.board_version(db, board_id, current_user.id)
+    if current is None:
+        raise HTTPException(status_code=404, detail="Board not found")
+    cached = versions.not_modified(
+        request, response, versions.etag("board", board_id, current.version)
+    )
+    if cached:
+        return cached
+    board = board_cache.cache.board(db, current, board_id, background_tasks)
+    if board is not None:
+        return serialization.value_response(board, response)
     board = crud.get_board(db, board_id, current_user.id)
     if not board:
         raise HTTPException(status_code=404, detail="Board not found")
@@ -1,117 +1,125 @@
-import json
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import or_
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app import crud, models, schemas
+from app import (
+    access,
+    async_crud,
+    board_cache,
+    changes,
+    crud,
+    pagination,
+    ranking,
+    schemas,
+    serialization,
+    versions,
+)
 from app.auth import get_user
-from app.database import get_db
-from app.websocket import manager
+from app.database import get_async_db
+from app.query_guard import query_budget
+from app.replica import get_read_db
 
 router = APIRouter(prefix="/lists", tags=["cards"])
 
 
 @router.post("/{list_id}/cards/", response_model=schemas.Card)
+@query_budget(9)
 async def create_card_for_list(
     list_id: int,
     card: schemas.CardCreate,
+    background_tasks: BackgroundTasks,
     current_user=Depends(get_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    list_item = (
-        db.query(models.List)
-        .join(models.Board)
-        .join(models.Workspace)
-        .filter(
-            models.List.id == list_id,
-            or_(
-                models.Workspace.owner_id == current_user.id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == current_user.id
-                    )
-                ),
-            ),
-        )
-        .first()
-    )
-    if not list_item:
+    workspace_id = await access.list_workspace_id_async(db, list_id, current_user.id)
+    if workspace_id is None:
         raise HTTPException(status_code=404, detail="List not found")
-    new_card = crud.create_card(db=db, card=card, list_id=list_id)
-    board = db.query(models.Board).filter(models.Board.id == list_item.board_id).first()
-    await manager.broadcast(
-        board.workspace_id,
-        json.dumps({"type": "card_created", "payload": new_card.to_dict()}),
-    )
-    return new_card
+    new_card = await async_crud.create_card(db=db, card=card, list_id=list_id)
+    if ranking.needs_rebalance(new_card.rank):
+        background_tasks.add_task(
+            changes.run_and_publish, crud.rebalance_card_ranks, list_id
+        )
+    body = await changes.publish(db)
+    return serialization.body_response(body) if body else new_card
 
 
 @router.get("/{list_id}/cards/", response_model=List[schemas.Card])
+@query_budget(5)
 def read_cards(
-    list_id: int, current_user=Depends(get_user), db: Session = Depends(get_db)
+    list_id: int,
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    page: pagination.Page = Depends(pagination.page_params),
+    current_user=Depends(get_user),
+    db: Session = Depends(get_read_db),
 ):
-    list_item = (
-        db.query(models.List)
-        .join(models.Board)
-        .join(models.Workspace)
-        .filter(
-            models.List.id == list_id,
-            or_(
-                models.Workspace.owner_id == current_user.id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == current_user.id
-                    )
-                ),
-            ),
-        )
-        .first()
-    )
-    if not list_item:
+    # Cards are covered by the version of the board holding their list.
+    current = versions.list_board_version(db, list_id, current_user.id)
+    if current is None:
         raise HTTPException(status_code=404, detail="List not found")
-    return crud.get_cards(db, list_id)
+    cached = versions.not_modified(
+        request, response, versions.etag("list", list_id, current.version)
+    )
+    if cached:
+        return cached
+    cards = board_cache.cache.cards(db, current, list_id, background_tasks)
+    if cards is not None:
+        cards = board_cache.page_of(cards, page)
+        cards = pagination.respond(response, cards, page, board_cache.rank_key)
+        return serialization.value_response(cards, response)
+    cards = crud.get_cards(db, list_id, page)
+    cards = pagination.respond(response, cards, page, pagination.rank_key)
+    return serialization.rows_response(cards, response)
 
 
 @router.patch("/{list_id}/cards/{card_id}", response_model=schemas.Card)
+@query_budget(10)
 async def update_card_for_list(
     list_id: int,
     card_id: int,
     card_update: schemas.CardUpdate,
+    background_tasks: BackgroundTasks,
     current_user=Depends(get_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    updated_card = crud.update_card(db, card_id, list_id, card_update, current_user.id)
+    try:
+        updated_card = await async_crud.update_card(
+            db, card_id, list_id, card_update, current_user.id
+        )
+    except versions.VersionConflict as conflict:
+        raise HTTPException(status_code=409, detail=str(conflict))
     if not updated_card:
         raise HTTPException(status_code=404, detail="Card not found")
-    list_item = db.query(models.List).filter(models.List.id == list_id).first()
-    board = db.query(models.Board).filter(models.Board.id == list_item.board_id).first()
-    await manager.broadcast(
-        board.workspace_id,
-        json.dumps({"type": "card_updated", "payload": updated_card.to_dict()}),
-    )
-    return updated_card
+    if ranking.needs_rebalance(updated_card.rank):
+        background_tasks.add_task(
+            changes.run_and_publish, crud.rebalance_card_ranks, updated_card.list_id
+        )
+    body = await changes.publish(db)
+    return serialization.body_response(body) if body else updated_card
 
 
 @router.delete("/{list_id}/cards/{card_id}/")
+@query_budget(7)
 async def delete_card(
     list_id: int,
     card_id: int,
     current_user=Depends(get_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    list_item = db.query(models.List).filter(models.List.id == list_id).first()
-    board = db.query(models.Board).filter(models.Board.id == list_item.board_id).first()
-    if not crud.delete_card(db, card_id, current_user.id, list_id):
+    workspace_id = await access.list_workspace_id_async(db, list_id, current_user.id)
+    if workspace_id is None or not await async_crud.delete_card(
+        db, card_id, current_user.id, list_id
+    ):
         raise HTTPException(status_code=404, detail="Card not found")
-    await manager.broadcast(
-        board.workspace_id,
-        json.dumps(
-            {
-                "type": "card_deleted",
-                "payload": {"card_id": card_id, "list_id": list_id},
-            }
-        ),
-    )
+    await changes.publish(db)
     return {"message": "Card deleted successfully"}
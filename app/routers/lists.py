@@ -1,112 +1,203 @@
-import json
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import or_
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+)
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app import crud, models, schemas
+from app import (
+    access,
+    async_crud,
+    board_cache,
+    changes,
+    crud,
+    models,
+    pagination,
+    ranking,
+    schemas,
+    serialization,
+    versions,
+)
 from app.auth import get_user
-from app.database import get_db
-from app.websocket import manager
+from app.database import get_async_db
+from app.query_guard import query_budget
+from app.replica import get_read_db
 
 router = APIRouter(prefix="/boards", tags=["lists"])
 
 
 @router.post("/{board_id}/lists/", response_model=schemas.List)
+@query_budget(9)
 async def create_list_for_board(
     board_id: int,
     list_item: schemas.ListCreate,
+    background_tasks: BackgroundTasks,
     current_user=Depends(get_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    board = (
-        db.query(models.Board)
-        .join(models.Workspace)
-        .filter(
-            models.Board.id == board_id,
-            or_(
-                models.Workspace.owner_id == current_user.id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == current_user.id
-                    )
-                ),
-            ),
-        )
-        .first()
-    )
-    if not board:
+    workspace_id = await access.board_workspace_id_async(db, board_id, current_user.id)
+    if workspace_id is None:
         raise HTTPException(status_code=404, detail="Board not found")
-    new_list = crud.create_list(db=db, list_item=list_item, board_id=board_id)
-    await manager.broadcast(
-        board.workspace_id,
-        json.dumps({"type": "list_created", "payload": new_list.to_dict()}),
+    new_list = await async_crud.create_list(
+        db=db, list_item=list_item, board_id=board_id
     )
-    return new_list
+    if ranking.needs_rebalance(new_list.rank):
+        background_tasks.add_task(
+            changes.run_and_publish, crud.rebalance_list_ranks, board_id
+        )
+    body = await changes.publish(db)
+    return serialization.body_response(body) if body else new_list
 
 
 @router.get("/{board_id}/lists/", response_model=List[schemas.List])
+@query_budget(5)
 def read_lists(
-    board_id: int, current_user=Depends(get_user), db: Session = Depends(get_db)
+    board_id: int,
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    page: pagination.Page = Depends(pagination.page_params),
+    current_user=Depends(get_user),
+    db: Session = Depends(get_read_db),
 ):
-    board = (
-        db.query(models.Board)
-        .join(models.Workspace)
-        .filter(
-            models.Board.id == board_id,
-            or_(
-                models.Workspace.owner_id == current_user.id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == current_user.id
-                    )
-                ),
-            ),
-        )
-        .first()
-    )
-    if not board:
+    current = versions.board_version(db, board_id, current_user.id)
+    if current is None:
         raise HTTPException(status_code=404, detail="Board not found")
-    return crud.get_lists(db, board_id)
+    cached = versions.not_modified(
+        request, response, versions.etag("board", board_id, current.version)
+    )
+    if cached:
+        return cached
+    lists = board_cache.cache.lists(db, current, board_id, background_tasks)
+    if lists is not None:
+        lists = board_cache.page_of(lists, page)
+        lists = pagination.respond(response, lists, page, board_cache.rank_key)
+        return serialization.value_response(lists, response)
+    lists = crud.get_lists(db, board_id, page)
+    lists = pagination.respond(response, lists, page, pagination.rank_key)
+    return serialization.rows_response(lists, response)
 
 
 @router.delete("/{board_id}/lists/{list_id}/")
+@query_budget(7)
 async def delete_list(
     board_id: int,
     list_id: int,
     current_user=Depends(get_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    board = (
-        db.query(models.Board)
-        .join(models.Workspace)
-        .filter(
-            models.Board.id == board_id,
-            or_(
-                models.Workspace.owner_id == current_user.id,
-                models.Workspace.id.in_(
-                    db.query(models.workspace_members.c.workspace_id).filter(
-                        models.workspace_members.c.user_id == current_user.id
-                    )
-                ),
-            ),
-        )
-        .first()
-    )
-    if not board:
+    workspace_id = await access.board_workspace_id_async(db, board_id, current_user.id)
+    if workspace_id is None:
         raise HTTPException(status_code=404, detail="Board not found")
 
-    if not crud.delete_list(db, list_id, current_user.id, board_id):
+    if not await async_crud.delete_list(db, list_id, current_user.id, board_id):
         raise HTTPException(status_code=404, detail="List not found")
 
-    await manager.broadcast(
-        board.workspace_id,
-        json.dumps(
-            {
-                "type": "list_deleted",
-                "payload": {"list_id": list_id, "board_id": board_id},
-            }
-        ),
-    )
+    await changes.publish(db)
     return {"message": "List deleted successfully"}
+
+
+@router.patch("/{board_id}/reorder", response_model=schemas.BoardReordered)
+# A rank lookup and an UPDATE per move.
+@query_budget(None)
+async def reorder_board(
+    board_id: int,
+    reorder: schemas.BoardReorder,
+    background_tasks: BackgroundTasks,
+    current_user=Depends(get_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    workspace_id = await access.board_workspace_id_async(db, board_id, current_user.id)
+    if workspace_id is None:
+        raise HTTPException(status_code=404, detail="Board not found")
+    moved = await async_crud.reorder_board(db, board_id, reorder)
+    if moved is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Reorder references a list or card outside this board",
+        )
+    moved_lists, moved_cards = moved
+
+    if any(ranking.needs_rebalance(list_item.rank) for list_item in moved_lists):
+        background_tasks.add_task(
+            changes.run_and_publish, crud.rebalance_list_ranks, board_id
+        )
+    for list_id in {
+        card.list_id for card in moved_cards if ranking.needs_rebalance(card.rank)
+    }:
+        background_tasks.add_task(
+            changes.run_and_publish, crud.rebalance_card_ranks, list_id
+        )
+
+    # The broadcast payload is this response.
+    body = await changes.publish(db)
+    if body:
+        return serialization.body_response(body)
+    return {"board_id": board_id, "lists": moved_lists, "cards": moved_cards}
+
+
+@router.get("/{board_id}/full", response_model=schemas.BoardFull)
+@query_budget(8)
+def read_board_full(
+    board_id: int,
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    stream: bool = False,
+    current_user=Depends(get_user),
+    db: Session = Depends(get_read_db),
+):
+    current = versions.board_version(db, board_id, current_user.id)
+    if current is None:
+        raise HTTPException(status_code=404, detail="Board not found")
+    tag = versions.etag("board", board_id, current.version)
+    cached = versions.not_modified(request, response, tag)
+    if cached:
+        return cached
+    # Streaming is for boards too large to build in memory; a cached one
+    # already is.
+    board = board_cache.cache.board_full(db, current, board_id, background_tasks)
+    if board is not None:
+        return serialization.value_response(board, response)
+    if stream:
+        board = crud.get_board(db, board_id, current_user.id)
+        if not board:
+            raise HTTPException(status_code=404, detail="Board not found")
+        return StreamingResponse(
+            _stream_board(db, board),
+            media_type="application/json",
+            headers={"ETag": tag, "Cache-Control": response.headers["Cache-Control"]},
+        )
+    board = crud.get_board_full(db, board_id, current_user.id)
+    if not board:
+        raise HTTPException(status_code=404, detail="Board not found")
+    return board
+
+
+def _stream_board(db: Session, board: models.Board):
+    lists = crud.get_lists(db, board.id)
+    cards = iter(crud.iter_board_cards(db, board.id))
+    pending = next(cards, None)
+
+    # The fields schemas.BoardFull gives the non-streamed response, not every
+    # column of the row.
+    fields = {column.key: getattr(board, column.key) for column in crud.BOARD_COLUMNS}
+    yield serialization.dumps(fields)[:-1] + ', "lists": ['
+    for index, list_item in enumerate(lists):
+        if index:
+            yield ", "
+        yield serialization.dumps(list_item._asdict())[:-1] + ', "cards": ['
+        first = True
+        while pending is not None and pending.list_id == list_item.id:
+            yield ("" if first else ", ") + serialization.dumps(pending._asdict())
+            first = False
+            pending = next(cards, None)
+        yield "]}"
+    yield "]}"
@@ -1,16 +1,68 @@
+import asyncio
+import os
+from typing import Optional
+
+import orjson
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
+from app import access, auth, changes
+from app.database import AsyncSessionLocal
 from app.websocket import manager
 
+# How long an accepted socket may take to send its auth message.
+WS_AUTH_TIMEOUT_SECONDS = float(os.getenv("WS_AUTH_TIMEOUT_SECONDS", "10"))
+
 router = APIRouter()
 
 
+async def _auth_token(websocket: WebSocket) -> Optional[str]:
+    # The first frame must be {"type": "auth", "token": <JWT>}: the same JWT
+    # the REST API takes as a bearer token. Browsers cannot set headers on a
+    # WebSocket, and a token in the URL would end up in access logs.
+    try:
+        message = orjson.loads(
+            await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT_SECONDS)
+        )
+    except (asyncio.TimeoutError, KeyError, ValueError):
+        # KeyError: a binary frame.
+        return None
+    if not isinstance(message, dict) or message.get("type") != "auth":
+        return None
+    token = message.get("token")
+    return token if isinstance(token, str) else None
+
+
 @router.websocket("/ws/{workspace_id}")
-async def websocket_endpoint(websocket: WebSocket, workspace_id: int):
-    await manager.connect(workspace_id, websocket)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    workspace_id: int,
+    since: Optional[int] = None,
+):
+    try:
+        codec = await manager.accept(websocket)
+        token = await _auth_token(websocket)
+    except WebSocketDisconnect:
+        return
+    # Checked once, on connect; the session is closed before any broadcast.
+    async with AsyncSessionLocal() as db:
+        user = await auth.get_user_async(db, token)
+        allowed = user is not None and await access.can_access_workspace_async(
+            db, user.id, workspace_id
+        )
+    if not allowed:
+        # 1008: policy violation.
+        await websocket.close(code=1008)
+        return
+    # ?since=N resumes after a reconnect: every change after seq N is sent
+    # before live messages.
+    replay = changes.replay(workspace_id, since) if since is not None else None
     try:
+        await manager.connect(workspace_id, websocket, codec, replay)
         while True:
             data = await websocket.receive_text()
-            await manager.broadcast(workspace_id, data)
-    except WebSocketDisconnect:
+            await manager.relay(workspace_id, data)
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the manager already closed this socket (slow consumer).
+        pass
+    finally:
         manager.disconnect(workspace_id, websocket)
@@ -1,47 +1,65 @@
-import json
+import io
+import tempfile
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app import crud, models, schemas
+from app import (
+    access,
+    async_crud,
+    board_cache,
+    changes,
+    crud,
+    pagination,
+    schemas,
+    serialization,
+    transfer,
+)
 from app.auth import get_user
-from app.database import get_db
+from app.database import get_async_db, get_db
+from app.query_guard import query_budget
+from app.replica import get_read_db
 from app.websocket import manager
 
 router = APIRouter()
 
 
 @router.post("/workspaces/", response_model=schemas.Workspace)
+@query_budget(4)
 async def create_workspace_for_user(
     workspace: schemas.WorkspaceCreate,
     current_user=Depends(get_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    new_workspace = crud.create_workspace(
+    new_workspace = await async_crud.create_workspace(
         db=db, workspace=workspace, user_id=current_user.id
     )
-    new_workspace_dict = new_workspace.to_dict()
-    await manager.broadcast(
-        new_workspace_dict["id"],
-        json.dumps(
-            jsonable_encoder(
-                {"type": "workspace_created", "payload": new_workspace_dict}
-            )
-        ),
-    )
+    await changes.publish(db)
     return new_workspace
 
 
 @router.get("/workspaces/", response_model=List[schemas.Workspace])
-def read_workspaces(current_user=Depends(get_user), db: Session = Depends(get_db)):
-    return crud.get_workspaces(db, current_user.id)
+@query_budget(4)
+def read_workspaces(
+    response: Response,
+    page: pagination.Page = Depends(pagination.page_params),
+    current_user=Depends(get_user),
+    db: Session = Depends(get_read_db),
+):
+    workspaces = crud.get_workspaces(db, current_user.id, page)
+    return pagination.respond(response, workspaces, page, pagination.id_key)
 
 
 @router.get("/workspaces/{workspace_id}/", response_model=schemas.Workspace)
+@query_budget(5)
 def read_workspace(
-    workspace_id: int, current_user=Depends(get_user), db: Session = Depends(get_db)
+    workspace_id: int,
+    current_user=Depends(get_user),
+    db: Session = Depends(get_read_db),
 ):
     workspace = crud.get_workspace_by_id(db, workspace_id, current_user.id)
     if not workspace:
@@ -50,81 +68,146 @@ def read_workspace(
 
 
 @router.delete("/workspaces/{workspace_id}/")
+@query_budget(5)
 async def delete_workspace(
-    workspace_id: int, current_user=Depends(get_user), db: Session = Depends(get_db)
+    workspace_id: int,
+    current_user=Depends(get_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    workspace = crud.get_workspace_by_id(db, workspace_id, current_user.id)
-    if not workspace:
+    if not await access.can_access_workspace_async(db, current_user.id, workspace_id):
         raise HTTPException(status_code=404, detail="Workspace not found")
-    if workspace.owner_id != current_user.id:
+    if not await async_crud.get_owned_workspace(db, workspace_id, current_user.id):
         raise HTTPException(
             status_code=403, detail="Only the owner can delete this workspace"
         )
-    num_deleted = (
-        db.query(models.Workspace).filter(models.Workspace.id == workspace_id).delete()
-    )
-    db.commit()
-    if num_deleted == 0:
+    if not await async_crud.delete_workspace(db, workspace_id, current_user.id):
         await manager.broadcast(
             workspace_id,
-            json.dumps(
-                jsonable_encoder(
-                    {
-                        "type": "workspace_deleted",
-                        "payload": {"workspace_id": workspace_id},
-                    }
-                )
+            serialization.dumps(
+                {"type": "workspace_deleted", "payload": {"workspace_id": workspace_id}}
             ),
         )
         raise HTTPException(status_code=500, detail="Failed to delete workspace")
+    board_cache.cache.discard(workspace_id)
     return {"message": "Workspace deleted successfully"}
 
 
 @router.post("/workspaces/{workspace_id}/members/", response_model=schemas.User)
+@query_budget(7)
 async def add_member(
     workspace_id: int,
     user_id: int,
     current_user=Depends(get_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    workspace = (
-        db.query(models.Workspace)
-        .filter(
-            models.Workspace.id == workspace_id,
-            models.Workspace.owner_id == current_user.id,
-        )
-        .first()
-    )
-    if not workspace:
+    if not await async_crud.get_owned_workspace(db, workspace_id, current_user.id):
         raise HTTPException(status_code=403, detail="Only owner can add members")
-    target_user = db.query(models.User).filter(models.User.id == user_id).first()
+    target_user = await async_crud.get_user(db, user_id)
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
-    crud.add_member_to_workspace(db, workspace_id, user_id)
-    await manager.broadcast(
-        workspace_id,
-        json.dumps(
-            jsonable_encoder(
-                {
-                    "type": "member_added",
-                    "payload": schemas.User.from_orm(target_user).dict(),
-                }
-            )
-        ),
-    )
+    await async_crud.add_member_to_workspace(db, workspace_id, user_id)
+    await changes.publish(db)
     return target_user
 
 
+@router.get("/workspaces/{workspace_id}/changes", response_model=schemas.ChangeFeed)
+@query_budget(4)
+async def read_changes(
+    workspace_id: int,
+    since: int = Query(0, ge=0),
+    limit: int = Query(
+        pagination.PAGE_SIZE_DEFAULT, ge=1, le=pagination.PAGE_SIZE_MAX
+    ),
+    current_user=Depends(get_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if not await access.can_access_workspace_async(db, current_user.id, workspace_id):
+        raise HTTPException(status_code=404, detail="Workspace not found")
+    return await changes.changes_since(db, workspace_id, since, limit)
+
+
 @router.get("/workspaces/{workspace_id}/members/", response_model=List[schemas.User])
+@query_budget(3)
 def read_members(
+    workspace_id: int,
+    response: Response,
+    page: pagination.Page = Depends(pagination.page_params),
+    current_user=Depends(get_user),
+    db: Session = Depends(get_read_db),
+):
+    if not access.can_access_workspace(db, current_user.id, workspace_id):
+        raise HTTPException(status_code=404, detail="Workspace not found")
+    members = crud.get_members(db, workspace_id, page)
+    return pagination.respond(response, members, page, pagination.id_key)
+
+
+@router.get(
+    "/workspaces/{workspace_id}/search",
+    response_model=List[schemas.CardSearchResult],
+)
+@query_budget(3)
+def search_cards(
+    workspace_id: int,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    page: pagination.Page = Depends(pagination.page_params),
+    current_user=Depends(get_user),
+    db: Session = Depends(get_read_db),
+):
+    if not access.can_access_workspace(db, current_user.id, workspace_id):
+        raise HTTPException(status_code=404, detail="Workspace not found")
+    cards = crud.search_cards(db, workspace_id, q, page)
+    return pagination.respond(
+        response, cards, page, lambda card: (-card.score, card.id)
+    )
+
+
+@router.get("/users/search/")
+@query_budget(2)
+def search_users(
+    q: str,
+    response: Response,
+    page: pagination.Page = Depends(pagination.page_params),
+    current_user=Depends(get_user),
+    db: Session = Depends(get_db),
+):
+    users = crud.search_users(db, q, current_user.id, page)
+    return pagination.respond(response, users, page, pagination.id_key)
+
+
+@router.get("/workspaces/{workspace_id}/export")
+@query_budget(8)
+def export_workspace(
     workspace_id: int, current_user=Depends(get_user), db: Session = Depends(get_db)
 ):
     workspace = crud.get_workspace_by_id(db, workspace_id, current_user.id)
     if not workspace:
         raise HTTPException(status_code=404, detail="Workspace not found")
-    return crud.get_members(db, workspace_id)
+    return StreamingResponse(
+        transfer.export_workspace(db, workspace),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="workspace-{workspace_id}.ndjson"'
+        },
+    )
 
 
-@router.get("/users/search/")
-def search_users(q: str, current_user=Depends(get_user), db: Session = Depends(get_db)):
-    return crud.search_users(db, q, current_user.id)
+@router.post("/workspaces/import", response_model=schemas.Workspace)
+# One INSERT per IMPORT_BATCH_SIZE boards or lists.
+@query_budget(None)
+async def import_workspace(
+    request: Request, current_user=Depends(get_user), db: Session = Depends(get_db)
+):
+    # Spool the upload (to disk past 8 MB) so the import can stream it through
+    # COPY in the threadpool without holding it in memory.
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        lines = io.TextIOWrapper(spool, encoding="utf-8")
+        try:
+            return await run_in_threadpool(
+                transfer.import_workspace, db, lines, current_user.id
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
+import typing
 from typing import Optional, List
 
 
@@ -75,6 +76,7 @@ class ListCreate(ListBase):
 class List(ListBase):
     id: int
     board_id: int
+    rank: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -93,13 +95,83 @@ class CardCreate(CardBase):
 class CardUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
+    # Index in the target list; the card's rank is placed between its new
+    # neighbours. Moving to another list without a position appends.
     position: Optional[int] = None
     list_id: Optional[int] = None
+    # The version the client last saw; a stale one is answered with 409.
+    version: Optional[int] = None
 
 
 class Card(CardBase):
     id: int
     list_id: int
+    rank: Optional[str] = None
+    version: int = 1
 
     class Config:
         from_attributes = True
+
+
+class CardSearchResult(BaseModel):
+    id: int
+    name: str
+    list_id: int
+    board_id: int
+    score: float
+    # Matching fragments of the name and description, matches in <mark>.
+    snippet: str
+
+    class Config:
+        from_attributes = True
+
+
+class ListWithCards(List):
+    cards: typing.List[Card] = []
+
+
+class BoardFull(Board):
+    lists: typing.List[ListWithCards] = []
+
+
+class CardMove(BaseModel):
+    card_id: int
+    list_id: int
+    # Place directly after this card in list_id; None moves to the top.
+    after_card_id: Optional[int] = None
+
+
+class ListMove(BaseModel):
+    list_id: int
+    after_list_id: Optional[int] = None
+
+
+class BoardReorder(BaseModel):
+    lists: typing.List[ListMove] = []
+    cards: typing.List[CardMove] = []
+
+
+class BoardReordered(BaseModel):
+    board_id: int
+    lists: typing.List[List] = []
+    cards: typing.List[Card] = []
+
+
+class Change(BaseModel):
+    seq: int
+    type: str
+    payload: dict
+
+    class Config:
+        from_attributes = True
+
+
+class ChangeFeed(BaseModel):
+    workspace_id: int
+    # Latest sequence number in the workspace when the feed was read.
+    seq: int
+    changes: typing.List[Change] = []
+    # More changes follow; ask again with since set to the last seq here.
+    has_more: bool = False
+    # Changes after ``since`` have been pruned; reload the workspace instead.
+    resync_required: bool = False
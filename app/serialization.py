@@ -0,0 +1,41 @@
+from typing import Iterable
+
+import orjson
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+
+# ORJSONResponse is the app's default response class. Routes that already have
+# their body as plain rows or as serialized bytes return one of these instead
+# of an ORM object, skipping response_model validation and jsonable_encoder;
+# response_model stays on the route for the schema.
+
+
+def _headers(response: Response) -> dict:
+    # The injected response carries the headers the route set (cursor, ETag)
+    # but also a content-length for its own empty body.
+    return {
+        name: value
+        for name, value in response.headers.items()
+        if name != "content-length"
+    }
+
+
+def rows_response(rows: Iterable, response: Response) -> ORJSONResponse:
+    """A JSON array of column-projected rows (see crud.LIST_COLUMNS)."""
+    return ORJSONResponse([row._asdict() for row in rows], headers=_headers(response))
+
+
+def value_response(value, response: Response) -> ORJSONResponse:
+    """Dicts (or lists of them) already shaped like the response model, such
+    as the rows app.board_cache holds."""
+    return ORJSONResponse(value, headers=_headers(response))
+
+
+def body_response(body: bytes) -> Response:
+    """A response whose body is already-serialized JSON, e.g. the payload a
+    change was broadcast with (see changes.publish)."""
+    return Response(content=body, media_type="application/json")
+
+
+def dumps(value) -> str:
+    return orjson.dumps(value).decode()
@@ -0,0 +1,237 @@
+import json
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+import app.access as access
+import app.models as models
+
+# Workspace export/import as NDJSON: one {"type": ..., "data": {...}} object per
+# line, always in the order export, workspace, boards, lists, cards, so an
+# import can remap parent IDs while streaming.
+FORMAT_VERSION = 1
+EXPORT_BATCH_SIZE = 2000
+IMPORT_BATCH_SIZE = 1000
+
+BOARD_COLUMNS = (models.Board.id, models.Board.name)
+LIST_COLUMNS = (
+    models.List.id,
+    models.List.name,
+    models.List.position,
+    models.List.rank,
+    models.List.board_id,
+)
+CARD_COLUMNS = (
+    models.Card.name,
+    models.Card.description,
+    models.Card.position,
+    models.Card.rank,
+    models.Card.list_id,
+)
+
+
+def _line(record_type: str, row) -> str:
+    return json.dumps({"type": record_type, "data": dict(row._mapping)}) + "\n"
+
+
+def export_workspace(db: Session, workspace: models.Workspace) -> Iterator[str]:
+    # yield_per streams each query through a server-side cursor, so memory
+    # stays flat however many cards the workspace holds.
+    yield json.dumps({"type": "export", "data": {"version": FORMAT_VERSION}}) + "\n"
+    yield json.dumps({"type": "workspace", "data": {"name": workspace.name}}) + "\n"
+    queries = (
+        (
+            "board",
+            select(*BOARD_COLUMNS)
+            .where(models.Board.workspace_id == workspace.id)
+            .order_by(models.Board.id),
+        ),
+        (
+            "list",
+            select(*LIST_COLUMNS)
+            .join(models.Board, models.List.board_id == models.Board.id)
+            .where(models.Board.workspace_id == workspace.id)
+            .order_by(models.List.id),
+        ),
+        (
+            "card",
+            select(*CARD_COLUMNS)
+            .join(models.List, models.Card.list_id == models.List.id)
+            .join(models.Board, models.List.board_id == models.Board.id)
+            .where(models.Board.workspace_id == workspace.id)
+            .order_by(models.Card.list_id, models.Card.rank, models.Card.id),
+        ),
+    )
+    for record_type, query in queries:
+        rows = db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for row in rows:
+            yield _line(record_type, row)
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class _CopyStream:
+    """File-like view over an iterator of COPY text rows, for copy_expert."""
+
+    def __init__(self, rows: Iterator[str]):
+        self.rows = rows
+        self.buffer = b""
+        # psycopg2 reports anything read() raises as QueryCanceled ("error in
+        # .read() call"); the original is kept for the caller to re-raise.
+        self.error: Optional[Exception] = None
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            try:
+                row = next(self.rows, None)
+            except Exception as exc:
+                self.error = exc
+                raise
+            if row is None:
+                break
+            self.buffer += row.encode()
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def import_workspace(
+    db: Session, lines: Iterable[str], user_id: int
+) -> models.Workspace:
+    """Create a new workspace owned by ``user_id`` from an export stream.
+
+    Boards and lists are inserted in batches with RETURNING to build the
+    old-to-new ID maps, cards go through COPY. Everything is one transaction;
+    malformed input raises ValueError and nothing is written.
+    """
+    records = (json.loads(line) for line in lines if line.strip())
+    try:
+        header = next(records)
+        if (
+            header.get("type") != "export"
+            or header["data"].get("version") != FORMAT_VERSION
+        ):
+            raise ValueError("Not a workspace export, or an unsupported version")
+        workspace_record = next(records)
+        if workspace_record.get("type") != "workspace":
+            raise ValueError("Export is missing its workspace record")
+
+        workspace = models.Workspace(
+            name=workspace_record["data"]["name"], owner_id=user_id
+        )
+        db.add(workspace)
+        db.flush()
+
+        board_ids, list_ids = {}, {}
+        batch, batch_type = [], None
+        card_rows = None
+
+        def flush_batch():
+            if batch_type == "board":
+                new_ids = db.scalars(
+                    insert(models.Board).returning(
+                        models.Board.id, sort_by_parameter_order=True
+                    ),
+                    [
+                        {"name": data["name"], "workspace_id": workspace.id}
+                        for data in batch
+                    ],
+                ).all()
+                board_ids.update(zip((data["id"] for data in batch), new_ids))
+            elif batch_type == "list":
+                new_ids = db.scalars(
+                    insert(models.List).returning(
+                        models.List.id, sort_by_parameter_order=True
+                    ),
+                    [
+                        {
+                            "name": data["name"],
+                            "position": data.get("position"),
+                            "rank": data.get("rank"),
+                            "board_id": board_ids[data["board_id"]],
+                        }
+                        for data in batch
+                    ],
+                ).all()
+                list_ids.update(zip((data["id"] for data in batch), new_ids))
+            batch.clear()
+
+        for record in records:
+            record_type, data = record.get("type"), record.get("data", {})
+            if record_type == "card":
+                flush_batch()
+                card_rows = _card_rows(data, records, list_ids)
+                break
+            if record_type not in ("board", "list") or (
+                batch_type == "list" and record_type == "board"
+            ):
+                raise ValueError(f"Unexpected {record_type!r} record")
+            if record_type != batch_type or len(batch) >= IMPORT_BATCH_SIZE:
+                flush_batch()
+                batch_type = record_type
+            batch.append(data)
+        else:
+            flush_batch()
+
+        if card_rows is not None:
+            cursor = db.connection().connection.cursor()
+            stream = _CopyStream(card_rows)
+            try:
+                cursor.copy_expert(
+                    "COPY cards (name, description, position, rank, list_id) "
+                    "FROM STDIN",
+                    stream,
+                )
+            except Exception:
+                if stream.error is not None:
+                    raise stream.error
+                raise
+        db.commit()
+    except (
+        AttributeError,
+        KeyError,
+        StopIteration,
+        TypeError,
+        json.JSONDecodeError,
+    ) as exc:
+        db.rollback()
+        raise ValueError(f"Malformed workspace export: {exc!r}") from exc
+    except Exception:
+        db.rollback()
+        raise
+    db.refresh(workspace)
+    access.invalidate_user(db, user_id)
+    return workspace
+
+
+def _card_rows(first: dict, records: Iterator[dict], list_ids: dict) -> Iterator[str]:
+    data = first
+    while True:
+        yield "\t".join(
+            _copy_value(value)
+            for value in (
+                data["name"],
+                data.get("description"),
+                data.get("position"),
+                data.get("rank"),
+                list_ids[data["list_id"]],
+            )
+        ) + "\n"
+        record = next(records, None)
+        if record is None:
+            return
+        if record.get("type") != "card":
+            raise ValueError(f"Unexpected {record.get('type')!r} record after cards")
+        data = record["data"]
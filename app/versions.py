@@ -0,0 +1,137 @@
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import app.access as access
+import app.models as models
+
+# Boards and workspaces carry a version that every mutation in app.crud and
+# app.async_crud increments in its own transaction. A board's version covers
+# the board, its lists and their cards; a workspace's covers its own row,
+# its members and which boards it holds. GET routes turn the version into an
+# ETag and answer a matching If-None-Match without loading any rows. The same
+# query returns the workspace's change_seq, which tells app.board_cache
+# whether its copy of the rows is current.
+
+
+class VersionConflict(Exception):
+    """An update named an older version than the row's current one."""
+
+    def __init__(self, current: int):
+        super().__init__(f"Modified since it was read; current version is {current}")
+        self.current = current
+
+
+def _bump_boards(where):
+    return update(models.Board).where(where).values(version=models.Board.version + 1)
+
+
+def _bump_board_query(board_id: int):
+    return _bump_boards(models.Board.id == board_id)
+
+
+def _bump_list_boards_query(list_ids):
+    return _bump_boards(
+        models.Board.id.in_(
+            select(models.List.board_id).where(models.List.id.in_(list_ids))
+        )
+    )
+
+
+def _bump_workspace_query(workspace_id: int):
+    return (
+        update(models.Workspace)
+        .where(models.Workspace.id == workspace_id)
+        .values(version=models.Workspace.version + 1)
+    )
+
+
+def bump_board(db: Session, board_id: int):
+    db.execute(_bump_board_query(board_id))
+
+
+def bump_list_boards(db: Session, *list_ids: int):
+    db.execute(_bump_list_boards_query(set(list_ids)))
+
+
+async def bump_board_async(db: AsyncSession, board_id: int):
+    await db.execute(_bump_board_query(board_id))
+
+
+async def bump_list_boards_async(db: AsyncSession, *list_ids: int):
+    await db.execute(_bump_list_boards_query(set(list_ids)))
+
+
+async def bump_workspace_async(db: AsyncSession, workspace_id: int):
+    await db.execute(_bump_workspace_query(workspace_id))
+
+
+def _current(db: Session, query, user_id: int):
+    row = db.execute(query).first()
+    if not row or not access.can_access_workspace(db, user_id, row.workspace_id):
+        return None
+    return row
+
+
+def board_version(db: Session, board_id: int, user_id: int):
+    """The board's version, workspace_id and workspace change_seq, or None if
+    it does not exist or is not accessible."""
+    return _current(
+        db,
+        select(
+            models.Board.version, models.Board.workspace_id, models.Workspace.change_seq
+        )
+        .join(models.Workspace, models.Workspace.id == models.Board.workspace_id)
+        .where(models.Board.id == board_id),
+        user_id,
+    )
+
+
+def list_board_version(db: Session, list_id: int, user_id: int):
+    """As board_version, for the board holding the list."""
+    return _current(
+        db,
+        select(
+            models.Board.version, models.Board.workspace_id, models.Workspace.change_seq
+        )
+        .join(models.Workspace, models.Workspace.id == models.Board.workspace_id)
+        .join(models.List, models.List.board_id == models.Board.id)
+        .where(models.List.id == list_id),
+        user_id,
+    )
+
+
+def workspace_version(db: Session, workspace_id: int, user_id: int):
+    """As board_version, for the workspace itself."""
+    if not access.can_access_workspace(db, user_id, workspace_id):
+        return None
+    return db.execute(
+        select(
+            models.Workspace.version,
+            models.Workspace.id.label("workspace_id"),
+            models.Workspace.change_seq,
+        ).where(models.Workspace.id == workspace_id)
+    ).first()
+
+
+def etag(kind: str, item_id: int, version: int) -> str:
+    return f'"{kind}-{item_id}-v{version}"'
+
+
+def not_modified(request: Request, response: Response, tag: str) -> Optional[Response]:
+    """Set the ETag; return a 304 response if the client already has it."""
+    # no-cache: browsers keep the body but revalidate it on every request.
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    response.headers.update(headers)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {
+            candidate.strip().removeprefix("W/")
+            for candidate in if_none_match.split(",")
+        }
+        if tag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+    return None
@@ -1,42 +1,278 @@
+import asyncio
 import logging
-from typing import Dict, List
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
+import orjson
 from fastapi import WebSocket
 
+from app import metrics, serialization, ws_codecs
+from app.backplane import Backplane, create_backplane
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_MAX_LAG_SECONDS = float(os.getenv("WS_MAX_LAG_SECONDS", "5"))
+# Broadcasts to a workspace within this window go out as one frame; 0 sends
+# every message as soon as it is broadcast.
+WS_COALESCE_WINDOW_MS = float(os.getenv("WS_COALESCE_WINDOW_MS", "30"))
+
+
+class _Connection:
+    def __init__(
+        self, websocket: WebSocket, queue_size: int, codec: ws_codecs.Codec
+    ):
+        self.websocket = websocket
+        self.codec = codec
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task = None
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+    def __init__(
+        self,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        max_lag: float = WS_MAX_LAG_SECONDS,
+        backplane: Backplane = None,
+        coalesce_window: float = WS_COALESCE_WINDOW_MS / 1000,
+    ):
+        self.active_connections: Dict[int, Dict[WebSocket, _Connection]] = {}
+        self.backplane = backplane or create_backplane()
+        self.backplane.deliver = self.fan_out
+        self.queue_size = queue_size
+        self.max_lag = max_lag
+        self.coalesce_window = coalesce_window
+        # workspace_id -> [(coalesce_key, message)] waiting for the window to
+        # close, and the task that will flush them.
+        self._pending: Dict[int, List[Tuple[Optional[str], str]]] = {}
+        self._flushers: Dict[int, asyncio.Task] = {}
+        self.messages_coalesced = 0
+        self.relays_rejected = 0
+        self.frames_batched = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.frames_encoded = 0
+        self.encode_failures = 0
+        self.messages_dropped = 0
+        self.connections_evicted = 0
+        self.send_failures = 0
         self.logger = logging.getLogger(__name__)
 
-    async def connect(self, workspace_id: int, websocket: WebSocket):
-        await websocket.accept()
+    async def accept(self, websocket: WebSocket) -> ws_codecs.Codec:
+        codec = ws_codecs.negotiate(websocket)
+        await websocket.accept(subprotocol=codec.name)
+        return codec
+
+    async def connect(
+        self,
+        workspace_id: int,
+        websocket: WebSocket,
+        codec: ws_codecs.Codec,
+        replay: AsyncIterator[str] = None,
+    ):
+        """Register an accepted socket for the workspace's broadcasts."""
+        connection = _Connection(websocket, self.queue_size, codec)
         if workspace_id not in self.active_connections:
-            self.active_connections[workspace_id] = []
-        self.active_connections[workspace_id].append(websocket)
+            self.backplane.subscribe(workspace_id)
+        connections = self.active_connections.setdefault(workspace_id, {})
+        connections[websocket] = connection
+        if replay is not None:
+            # Registered before replaying, so live messages published meanwhile
+            # queue up behind the backlog instead of being missed. Both carry
+            # a seq; clients skip anything at or below the last one applied.
+            async for message in replay:
+                await self._send(websocket, codec.encode(message))
+            if websocket not in connections:
+                return
+        connection.writer = asyncio.create_task(self._write(workspace_id, connection))
         self.logger.info(
-            f"New connection added to workspace {workspace_id}. Total connections: {len(self.active_connections[workspace_id])}"
+            f"New connection added to workspace {workspace_id}. Total connections: {len(connections)}"
         )
 
     def disconnect(self, workspace_id: int, websocket: WebSocket):
-        if (
-            workspace_id in self.active_connections
-            and websocket in self.active_connections[workspace_id]
-        ):
-            self.active_connections[workspace_id].remove(websocket)
-            self.logger.info(
-                f"Connection removed from workspace {workspace_id}. Total connections: {len(self.active_connections[workspace_id])}"
+        connections = self.active_connections.get(workspace_id)
+        if not connections or websocket not in connections:
+            return
+        connection = connections.pop(websocket)
+        if connection.writer and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        self.logger.info(
+            f"Connection removed from workspace {workspace_id}. Total connections: {len(connections)}"
+        )
+        if not connections:
+            del self.active_connections[workspace_id]
+            self.backplane.unsubscribe(workspace_id)
+
+    async def broadcast(
+        self, workspace_id: int, message: str, coalesce_key: Optional[str] = None
+    ):
+        """Send ``message`` to every socket on the workspace, batched per window.
+
+        A message with a coalesce_key (the entity it carries the full latest
+        state of) replaces an earlier pending one with the same key, provided
+        only other keyed messages were broadcast in between.
+        """
+        if self.coalesce_window <= 0:
+            await self.backplane.publish(workspace_id, message)
+            return
+        pending = self._pending.setdefault(workspace_id, [])
+        if coalesce_key is not None:
+            for index in range(len(pending) - 1, -1, -1):
+                key = pending[index][0]
+                if key is None:
+                    break
+                if key == coalesce_key:
+                    del pending[index]
+                    self.messages_coalesced += 1
+                    break
+        pending.append((coalesce_key, message))
+        if workspace_id not in self._flushers:
+            self._flushers[workspace_id] = asyncio.create_task(
+                self._flush_later(workspace_id)
             )
-            if not self.active_connections[workspace_id]:
-                del self.active_connections[workspace_id]
-
-    async def broadcast(self, workspace_id: int, message: str):
-        if workspace_id in self.active_connections:
-            for connection in self.active_connections[workspace_id]:
-                await connection.send_text(message)
-                self.logger.info(
-                    f"Broadcasted message to workspace {workspace_id}: {message}"
+
+    async def relay(self, workspace_id: int, text: str) -> bool:
+        """Broadcast a frame a client sent, if it is a JSON object.
+
+        Everything else broadcast is JSON the server produced, which batches
+        join as text and codecs parse. Client text is re-serialized here so
+        that a malformed frame is refused before it can corrupt either.
+        """
+        try:
+            message = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            message = None
+        if not isinstance(message, dict):
+            self.relays_rejected += 1
+            return False
+        await self.broadcast(workspace_id, serialization.dumps(message))
+        return True
+
+    async def _flush_later(self, workspace_id: int):
+        try:
+            await asyncio.sleep(self.coalesce_window)
+        finally:
+            del self._flushers[workspace_id]
+            messages = [message for _, message in self._pending.pop(workspace_id)]
+        if len(messages) == 1:
+            frame = messages[0]
+        else:
+            # Messages are already JSON; join them instead of re-encoding.
+            frame = '{"type": "batch", "events": [' + ", ".join(messages) + "]}"
+            self.frames_batched += 1
+        try:
+            await self.backplane.publish(workspace_id, frame)
+        except Exception:
+            self.logger.exception(f"Broadcast to workspace {workspace_id} failed")
+
+    def fan_out(self, workspace_id: int, message: str):
+        # Only enqueues: each socket has its own writer task, so a slow client
+        # never holds up the others or the request that triggered the event.
+        connections = self.active_connections.get(workspace_id)
+        if not connections:
+            return
+        started = time.perf_counter()
+        enqueued_at = time.monotonic()
+        # Encoded once per wire format, shared by every socket that uses it.
+        frames = {}
+        for connection in list(connections.values()):
+            codec = connection.codec
+            if codec not in frames:
+                # A message one format cannot carry is skipped for that
+                # format's sockets only; this runs inside the backplane's
+                # reader and flush tasks, which must not fail.
+                try:
+                    frames[codec] = codec.encode(message)
+                    self.frames_encoded += 1
+                except Exception:
+                    frames[codec] = None
+                    self.encode_failures += 1
+                    self.logger.exception(
+                        f"Could not encode a message to workspace {workspace_id} "
+                        f"as {codec.name or 'json'}"
+                    )
+            frame = frames[codec]
+            if frame is None:
+                continue
+            try:
+                connection.queue.put_nowait((enqueued_at, frame))
+            except asyncio.QueueFull:
+                self.messages_dropped += 1
+                self._evict(workspace_id, connection, "send queue full")
+        metrics.BROADCAST_FAN_OUT.observe(time.perf_counter() - started)
+
+    async def _write(self, workspace_id: int, connection: _Connection):
+        try:
+            while True:
+                enqueued_at, frame = await connection.queue.get()
+                if time.monotonic() - enqueued_at > self.max_lag:
+                    self.messages_dropped += 1 + connection.queue.qsize()
+                    self._evict(workspace_id, connection, "lag budget exceeded")
+                    return
+                await asyncio.wait_for(
+                    self._send(connection.websocket, frame), self.max_lag
                 )
+                self.messages_sent += 1
+                self.bytes_sent += len(frame)
+        except asyncio.TimeoutError:
+            self.send_failures += 1
+            self._evict(workspace_id, connection, "send timed out")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.send_failures += 1
+            self.disconnect(workspace_id, connection.websocket)
+
+    @staticmethod
+    async def _send(websocket: WebSocket, frame):
+        if isinstance(frame, bytes):
+            await websocket.send_bytes(frame)
+        else:
+            await websocket.send_text(frame)
+
+    def _evict(self, workspace_id: int, connection: _Connection, reason: str):
+        if connection.websocket not in self.active_connections.get(workspace_id, {}):
+            return
+        self.connections_evicted += 1
+        self.logger.warning(
+            f"Evicting slow connection from workspace {workspace_id}: {reason}"
+        )
+        self.disconnect(workspace_id, connection.websocket)
+        asyncio.create_task(self._close(connection.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            # 1013: try again later; the client reconnects and resyncs.
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def stats(self):
+        depths = [
+            connection.queue.qsize()
+            for connections in self.active_connections.values()
+            for connection in connections.values()
+        ]
+        return {
+            "workspaces": len(self.active_connections),
+            "connections": len(depths),
+            "connections_per_workspace": {
+                workspace_id: len(connections)
+                for workspace_id, connections in self.active_connections.items()
+            },
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "messages_sent": self.messages_sent,
+            "bytes_sent": self.bytes_sent,
+            "frames_encoded": self.frames_encoded,
+            "encode_failures": self.encode_failures,
+            "messages_dropped": self.messages_dropped,
+            "messages_coalesced": self.messages_coalesced,
+            "frames_batched": self.frames_batched,
+            "relays_rejected": self.relays_rejected,
+            "pending_broadcasts": sum(len(p) for p in self._pending.values()),
+            "connections_evicted": self.connections_evicted,
+            "send_failures": self.send_failures,
+        }
 
 
 manager = ConnectionManager()
@@ -0,0 +1,57 @@
+import os
+import zlib
+from typing import Callable, Dict, Optional, Union
+
+import msgpack
+import orjson
+from fastapi import WebSocket
+
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+
+# Messages travel through the manager and the backplane as JSON text. Each
+# socket picks a wire format with a WebSocket subprotocol when it connects,
+# and fan-out encodes every message once per format in use, not once per
+# socket. The "+deflate" formats are compressed here rather than by the
+# WebSocket extension, which compresses separately for every connection.
+
+
+class Codec:
+    def __init__(
+        self, name: Optional[str], encode: Callable[[str], Union[str, bytes]]
+    ):
+        self.name = name
+        self.encode = encode
+
+
+def _deflate(data: bytes) -> bytes:
+    # Raw deflate (no zlib header): DecompressionStream("deflate-raw") in the
+    # browser, zlib.decompress(data, -15) elsewhere.
+    compressor = zlib.compressobj(WS_DEFLATE_LEVEL, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _msgpack(message: str) -> bytes:
+    return msgpack.packb(orjson.loads(message))
+
+
+JSON = Codec(None, lambda message: message)
+
+CODECS: Dict[str, Codec] = {
+    "kanban.json": Codec("kanban.json", JSON.encode),
+    "kanban.json+deflate": Codec(
+        "kanban.json+deflate", lambda message: _deflate(message.encode())
+    ),
+    "kanban.msgpack": Codec("kanban.msgpack", _msgpack),
+    "kanban.msgpack+deflate": Codec(
+        "kanban.msgpack+deflate", lambda message: _deflate(_msgpack(message))
+    ),
+}
+
+
+def negotiate(websocket: WebSocket) -> Codec:
+    """The first subprotocol the client offered that we speak; plain JSON text
+    frames if it offered none of them."""
+    for name in websocket.scope.get("subprotocols", []):
+        if name in CODECS:
+            return CODECS[name]
+    return JSON
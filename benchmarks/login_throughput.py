@@ -0,0 +1,73 @@
+"""bcrypt verifications per second against the size of the hashing process pool.
+
+    python -m benchmarks.login_throughput [--rounds 12] [--logins 200]
+
+Runs app.hashing.verify_and_update, the call /auth/token makes, with enough
+concurrent logins to keep every worker busy. Needs no database. Each pool size
+is run in a fresh interpreter so HASH_WORKERS and BCRYPT_ROUNDS are read the
+same way the server reads them.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+async def run_pool(logins):
+    from app import hashing
+
+    hashed = hashing.pwd_context.hash("correct horse battery staple")
+    # Warm the pool so worker start-up is not part of the measurement.
+    await asyncio.gather(
+        *(hashing.hash_password("warm-up") for _ in range(hashing.HASH_WORKERS))
+    )
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            hashing.verify_and_update("correct horse battery staple", hashed)
+            for _ in range(logins)
+        )
+    )
+    elapsed = time.perf_counter() - started
+    hashing.shutdown()
+    print(json.dumps({"workers": hashing.HASH_WORKERS, "logins_per_second": logins / elapsed}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        asyncio.run(run_pool(args.logins))
+        return
+
+    cores = os.cpu_count() or 1
+    sizes = sorted({1, 2, 4, 8, 16, cores} & set(range(1, cores + 1)))
+    print(f"bcrypt cost {args.rounds}, {args.logins} logins, {cores} cores")
+    for workers in sizes:
+        env = dict(
+            os.environ,
+            BCRYPT_ROUNDS=str(args.rounds),
+            HASH_WORKERS=str(workers),
+            HASH_MAX_PENDING=str(args.logins + workers),
+        )
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.login_throughput", "--worker",
+             "--logins", str(args.logins)],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{workers:>3} workers: {result['logins_per_second']:8.1f} logins/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Bytes on the wire and CPU per 1k recipients for each WebSocket wire format.
+
+    python -m benchmarks.ws_encoding
+
+Broadcasts typical workspace events (a card update, a board reorder of
+--cards cards and a coalesced batch of card updates) through
+ConnectionManager.fan_out to --recipients sockets that all negotiated the
+same format, and reports the frame size and the CPU time per broadcast.
+"per-socket deflate" is the old path for comparison: the same JSON text
+compressed separately for every connection, which is what the
+permessage-deflate WebSocket extension does. No database is needed.
+"""
+import argparse
+import json
+import time
+import zlib
+
+
+def card(card_id):
+    return {
+        "id": card_id,
+        "name": f"Card {card_id}: follow up with the design review",
+        "description": "Collect feedback from the team and update the mockups.",
+        "position": card_id,
+        "list_id": 1 + card_id % 8,
+        "rank": f"a{card_id:05d}",
+    }
+
+
+def event(event_type, seq, payload):
+    return json.dumps({"type": event_type, "seq": seq, "payload": payload})
+
+
+def sample_messages(cards):
+    reorder = {
+        "board_id": 1,
+        "lists": [
+            {
+                "id": i,
+                "name": f"List {i}",
+                "position": i,
+                "board_id": 1,
+                "rank": f"a{i}",
+            }
+            for i in range(1, 9)
+        ],
+        "cards": [card(i) for i in range(1, cards + 1)],
+    }
+    updates = [event("card_updated", seq, card(seq)) for seq in range(20)]
+    return {
+        "card_updated": event("card_updated", 1, card(1)),
+        "board_reordered": event("board_reordered", 2, reorder),
+        "batch": '{"type": "batch", "events": [' + ", ".join(updates) + "]}",
+    }
+
+
+def shared_encoding(codec, message, recipients, rounds):
+    from app.websocket import ConnectionManager, _Connection
+
+    manager = ConnectionManager(queue_size=rounds + 1)
+    connections = {
+        socket: _Connection(socket, rounds + 1, codec)
+        for socket in (object() for _ in range(recipients))
+    }
+    manager.active_connections[1] = connections
+    started = time.process_time()
+    for _ in range(rounds):
+        manager.fan_out(1, message)
+    elapsed = time.process_time() - started
+    _, frame = next(iter(connections.values())).queue.get_nowait()
+    return len(frame), elapsed / rounds
+
+
+def per_socket_deflate(message, recipients, rounds):
+    # permessage-deflate compresses every frame separately for each connection.
+    # A fresh compressor per frame (no context takeover) keeps repeating the
+    # same message from shrinking it to a back-reference.
+    data = message.encode()
+    started = time.process_time()
+    for _ in range(rounds):
+        for _ in range(recipients):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            frame = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    elapsed = time.process_time() - started
+    return len(frame), elapsed / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--cards", type=int, default=200)
+    args = parser.parse_args()
+
+    from app import ws_codecs
+
+    for label, message in sample_messages(args.cards).items():
+        print(f"{label} ({len(message)} bytes as JSON text)")
+        for name, codec in [("json", ws_codecs.JSON), *ws_codecs.CODECS.items()]:
+            if name == "kanban.json":
+                continue
+            size, cpu = shared_encoding(codec, message, args.recipients, args.rounds)
+            print(
+                f"  {name:>24}: {size:8d} bytes/frame  "
+                f"{cpu * 1000:8.2f} ms CPU per {args.recipients} recipients"
+            )
+        size, cpu = per_socket_deflate(message, args.recipients, args.rounds)
+        print(
+            f"  {'per-socket deflate':>24}: {size:8d} bytes/frame  "
+            f"{cpu * 1000:8.2f} ms CPU per {args.recipients} recipients"
+        )
+
+
+if __name__ == "__main__":
+    main()
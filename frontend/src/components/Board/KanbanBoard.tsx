@@ -18,7 +18,10 @@ import {
 import { ListItem, Card, Board } from "../../types";
 import Modal from "../common/Modal.tsx";
 import { useLanguage } from "../../contexts/LanguageContext.tsx";
-import { useWebSocket } from "../../contexts/WebSocketContext.tsx";
+import {
+  parseEvents,
+  useWebSocket,
+} from "../../contexts/WebSocketContext.tsx";
 
 interface KanbanBoardProps {
   board: Board;
@@ -45,16 +48,15 @@ const KanbanBoard: React.FC<KanbanBoardProps> = ({ board }) => {
 
   useEffect(() => {
     if (webSocket && webSocket.lastMessage) {
-      const message = JSON.parse(webSocket.lastMessage.data);
-      if (message.type === "card_updated") {
-        fetchData();
-      } else if (message.type === "card_created") {
-        fetchData();
-      } else if (message.type === "card_deleted") {
-        fetchData();
-      } else if (message.type === "list_created") {
-        fetchData();
-      } else if (message.type === "list_deleted") {
+      const refetchOn = [
+        "card_updated",
+        "card_created",
+        "card_deleted",
+        "list_created",
+        "list_deleted",
+      ];
+      const events = parseEvents(webSocket.lastMessage);
+      if (events.some((message) => refetchOn.includes(message.type))) {
         fetchData();
       }
     }
@@ -89,16 +91,14 @@ const KanbanBoard: React.FC<KanbanBoardProps> = ({ board }) => {
 
   const handleDragEnd = async (result: DropResult) => {
     if (!result.destination) return;
-    const { source, destination, draggableId } = result;
+    const { source, destination } = result;
     if (source.droppableId === destination.droppableId) {
       const listId = Number(source.droppableId);
       const cards = [...cardsByList[listId]];
       const [moved] = cards.splice(source.index, 1);
       cards.splice(destination.index, 0, moved);
       setCardsByList({ ...cardsByList, [listId]: cards });
-      await updateCard(listId, Number(draggableId), {
-        position: destination.index,
-      });
+      await saveMove(listId, moved, { position: destination.index });
     } else {
       const sourceListId = Number(source.droppableId);
       const destListId = Number(destination.droppableId);
@@ -111,13 +111,43 @@ const KanbanBoard: React.FC<KanbanBoardProps> = ({ board }) => {
         [sourceListId]: sourceCards,
         [destListId]: destCards,
       });
-      await updateCard(sourceListId, Number(draggableId), {
+      await saveMove(sourceListId, moved, {
         list_id: destListId,
         position: destination.index,
       });
     }
   };
 
+  const saveMove = async (
+    listId: number,
+    card: Card,
+    move: { list_id?: number; position: number },
+  ) => {
+    try {
+      const saved = await updateCard(listId, card.id, {
+        ...move,
+        version: card.version,
+      });
+      // Keep the new version, or the card's next move would get a 409.
+      setCardsByList((current) => {
+        const updated: Record<number, Card[]> = {};
+        Object.entries(current).forEach(([id, cards]) => {
+          updated[Number(id)] = cards.map((c) =>
+            c.id === saved.id ? { ...c, ...saved } : c,
+          );
+        });
+        return updated;
+      });
+    } catch (error: any) {
+      // 409: someone else changed the card first; show their version.
+      if (error.response?.status === 409) {
+        fetchData();
+      } else {
+        throw error;
+      }
+    }
+  };
+
   const handleCreateList = async () => {
     if (newListName.trim() && boardId) {
       const position = lists.length;
@@ -12,7 +12,10 @@ import {
 import { Board, User, Workspace } from "../../types.ts";
 import Modal from "../common/Modal.tsx";
 import { useLanguage } from "../../contexts/LanguageContext.tsx";
-import { useWebSocket } from "../../contexts/WebSocketContext.tsx";
+import {
+  parseEvents,
+  useWebSocket,
+} from "../../contexts/WebSocketContext.tsx";
 
 const Boards: React.FC = () => {
   const { id: workspaceId } = useParams<{ id: string }>();
@@ -33,15 +36,16 @@ const Boards: React.FC = () => {
 
   useEffect(() => {
     if (webSocket && webSocket.lastMessage) {
-      const message = JSON.parse(webSocket.lastMessage.data);
-      if (message.type === "board_created") {
-        const newBoard = message.payload as Board;
-        setBoards((prevBoards) => {
-          if (prevBoards.find((board) => board.id === newBoard.id)) {
-            return prevBoards;
-          }
-          return [...prevBoards, newBoard];
-        });
+      for (const message of parseEvents(webSocket.lastMessage)) {
+        if (message.type === "board_created") {
+          const newBoard = message.payload as Board;
+          setBoards((prevBoards) => {
+            if (prevBoards.find((board) => board.id === newBoard.id)) {
+              return prevBoards;
+            }
+            return [...prevBoards, newBoard];
+          });
+        }
       }
     }
   }, [webSocket, webSocket?.lastMessage]);
@@ -11,6 +11,13 @@ export const useWebSocket = () => {
   return useContext(WebSocketContext);
 };
 
+// The server batches events broadcast within a few milliseconds of each
+// other into one {"type": "batch", "events": [...]} frame.
+export const parseEvents = (message: MessageEvent): any[] => {
+  const data = JSON.parse(message.data);
+  return data.type === "batch" ? data.events : [data];
+};
+
 interface WebSocketProviderProps {
   children: React.ReactNode;
   workspaceId: number;
@@ -32,6 +39,10 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
     const ws = new WebSocket(`${proto}//${host}/ws/${workspaceId}`);
 
     ws.onopen = () => {
+      // Browsers cannot set headers on a WebSocket, and a token in the URL
+      // would be logged; the server expects it in the first message.
+      const token = localStorage.getItem("token") || "";
+      ws.send(JSON.stringify({ type: "auth", token }));
       console.log("WebSocket connected");
     };
 
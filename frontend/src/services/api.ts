@@ -1,8 +1,12 @@
 import axios from "axios";
 import { Workspace, Board, ListItem, Card, User } from "../types";
 
+// withCredentials: in development the API is another origin, and the
+// last_write cookie that keeps reads after a write off a lagging replica is
+// only stored and sent back for credentialed requests.
 const api = axios.create({
   baseURL: "http://localhost:8000",
+  withCredentials: true,
 });
 
 api.interceptors.request.use((config) => {
@@ -15,9 +19,26 @@ api.interceptors.request.use((config) => {
 
 export { api };
 
+// Collection endpoints are paginated: each response is one page and the
+// X-Next-Cursor header, when present, fetches the next one.
+const getAllPages = async <T>(
+  url: string,
+  params: Record<string, string> = {},
+): Promise<T[]> => {
+  const items: T[] = [];
+  let cursor: string | undefined;
+  do {
+    const response = await api.get(url, {
+      params: cursor ? { ...params, cursor } : params,
+    });
+    items.push(...response.data);
+    cursor = response.headers["x-next-cursor"];
+  } while (cursor);
+  return items;
+};
+
 export const getWorkspaces = async (): Promise<Workspace[]> => {
-  const response = await api.get("/api/workspaces/");
-  return response.data;
+  return getAllPages<Workspace>("/api/workspaces/");
 };
 
 export const createWorkspace = async (data: {
@@ -58,8 +79,7 @@ export const getBoard = async (boardId: number): Promise<Board> => {
 };
 
 export const getLists = async (boardId: number): Promise<ListItem[]> => {
-  const response = await api.get(`/api/boards/${boardId}/lists/`);
-  return response.data;
+  return getAllPages<ListItem>(`/api/boards/${boardId}/lists/`);
 };
 
 export const createList = async (
@@ -78,8 +98,7 @@ export const deleteList = async (
 };
 
 export const getCards = async (listId: number): Promise<Card[]> => {
-  const response = await api.get(`/api/lists/${listId}/cards/`);
-  return response.data;
+  return getAllPages<Card>(`/api/lists/${listId}/cards/`);
 };
 
 export const createCard = async (
@@ -98,6 +117,7 @@ export const updateCard = async (
     description?: string;
     position: number;
     list_id: number;
+    version: number;
   }>,
 ): Promise<Card> => {
   const response = await api.patch(
@@ -120,6 +140,7 @@ export const getCurrentUser = async (): Promise<User> => {
 };
 
 export const searchUsers = async (query: string): Promise<User[]> => {
+  // Search results only need the best first page.
   const response = await api.get("/api/users/search/", {
     params: { q: query },
   });
@@ -141,6 +162,5 @@ export const addMember = async (
 };
 
 export const getMembers = async (workspaceId: number): Promise<User[]> => {
-  const response = await api.get(`/api/workspaces/${workspaceId}/members/`);
-  return response.data;
+  return getAllPages<User>(`/api/workspaces/${workspaceId}/members/`);
 };
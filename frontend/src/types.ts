@@ -32,6 +32,7 @@ export interface Card {
   description?: string;
   position: number;
   list_id: number;
+  version: number;
 }
 
 export interface Token {